@@ -0,0 +1,448 @@
+# agentSandbox.py
+# ---------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Runs a capture team in its own process, so that a slow, crashing or
+memory-hungry team cannot take the game runner down with it.
+
+A SandboxedTeam starts a worker (this file run as a script) that loads the
+team module, and its createTeam method stands in for the module's:
+
+team = SandboxedTeam('myTeam', memoryLimit=512 << 20)
+agents = team.createTeam(0, 2, True)
+
+The returned SandboxedAgents forward registerInitialState, getAction and
+final to the worker over a pipe.  The parent makes each observation, so the
+worker only ever sees what the agent may see, and sends it in a compact
+struct encoding; the worker answers with the action and the CPU time the
+call used.  A call may use at most MOVE_CPU_TIME (getAction) or
+STARTUP_CPU_TIME (anything else) seconds of CPU, to the second, or the
+worker is stopped.  When a call is cut short (a timeout) or the worker
+dies, the worker is killed and a fresh one is started, with the team
+created again, the next time the team is used.
+
+The team is created with a seed drawn from the parent's random module, so
+a fixed seed (-f) replays the same games.
+"""
+
+import os, sys, struct, select, errno, signal, random, binascii, subprocess, traceback, cPickle
+try:
+  import resource
+except ImportError:
+  resource = None
+
+from game import Directions, Configuration, AgentState, Grid
+
+# Message types.  The parent sends LOAD, CREATE, REGISTER, ACT and FINAL;
+# the worker answers with DONE, ACTION or ERROR.
+LOAD, CREATE, REGISTER, ACT, FINAL, DONE, ACTION, ERROR = range(8)
+
+MESSAGE = struct.Struct('!BBI')          # type, agent index, payload length
+STATE = struct.Struct('!iiHHBBBB')       # score, timeleft, red and blue returned, agents, capsules, agent moved, has distances
+AGENT = struct.Struct('!BhhBHHH')        # flags, x, y, direction, scared timer, carrying, returned
+POSITION = struct.Struct('!hh')
+DISTANCE = struct.Struct('!h')
+REPLY = struct.Struct('!d')              # CPU seconds used by the call
+ACTION_REPLY = struct.Struct('!Bd')      # direction, CPU seconds
+
+HAS_CONFIGURATION = 1
+IS_PACMAN = 2
+NO_AGENT = 255
+
+DIRECTIONS = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP]
+DIRECTION_CODES = dict([(direction, i) for i, direction in enumerate(DIRECTIONS)])
+
+# Seconds between checks for a timeout while waiting for the worker
+POLL_INTERVAL = 0.05
+
+# CPU seconds a call may use in the worker, as CaptureRules allows in time
+MOVE_CPU_TIME = 3
+STARTUP_CPU_TIME = 15
+
+class SandboxError(Exception):
+  "Raised in the parent when a sandboxed agent fails or its worker dies"
+  pass
+
+###############
+# The encoding #
+###############
+
+def encodeState(state):
+  """
+  Encodes what an agent can see of a capture GameState: the score, the time
+  left, the food returned, every agent's state (its configuration is left
+  out when it is not visible), the capsules, the food and the noisy
+  distances of an observation.
+  """
+  data = state.data
+  agentStates = data.agentStates
+  distances = state.getAgentDistances() or []
+  moved = data._agentMoved
+  parts = [STATE.pack(data.score, data.timeleft, data.redReturned, data.blueReturned, len(agentStates),
+                      len(data.capsules), moved is None and NO_AGENT or moved, len(distances) > 0)]
+  for agentState in agentStates:
+    flags = agentState.isPacman and IS_PACMAN or 0
+    x = y = direction = 0
+    configuration = agentState.configuration
+    if configuration is not None:
+      flags |= HAS_CONFIGURATION
+      x, y = configuration.pos
+      direction = DIRECTION_CODES[configuration.direction]
+    parts.append(AGENT.pack(flags, int(x), int(y), direction, agentState.scaredTimer,
+                            agentState.numCarrying, agentState.numReturned))
+  for x, y in data.capsules:
+    parts.append(POSITION.pack(x, y))
+  for distance in distances:
+    parts.append(DISTANCE.pack(distance))
+  food = data.food
+  numBytes = (food.width * food.height + 7) / 8
+  parts.append(binascii.unhexlify('%0*x' % (2 * numBytes, food.bits)))
+  return ''.join(parts)
+
+def decodeState(payload, initialState):
+  """
+  Rebuilds a GameState from encodeState's payload, taking the layout, the
+  teams and the agents' start configurations from initialState, the
+  initial state of the game.
+  """
+  state = initialState.deepCopy()
+  data = state.data
+  score, timeleft, redReturned, blueReturned, numAgents, numCapsules, moved, hasDistances = STATE.unpack_from(payload)
+  offset = STATE.size
+  agentStates = []
+  for i in range(numAgents):
+    flags, x, y, direction, scaredTimer, numCarrying, numReturned = AGENT.unpack_from(payload, offset)
+    offset += AGENT.size
+    agentState = AgentState(initialState.data.agentStates[i].start, bool(flags & IS_PACMAN))
+    if flags & HAS_CONFIGURATION:
+      agentState.configuration = Configuration((x, y), DIRECTIONS[direction])
+    else:
+      agentState.configuration = None
+    agentState.scaredTimer = scaredTimer
+    agentState.numCarrying = numCarrying
+    agentState.numReturned = numReturned
+    agentStates.append(agentState)
+  capsules = []
+  for i in range(numCapsules):
+    capsules.append(POSITION.unpack_from(payload, offset))
+    offset += POSITION.size
+  distances = []
+  if hasDistances:
+    for i in range(numAgents):
+      distances.append(DISTANCE.unpack_from(payload, offset)[0])
+      offset += DISTANCE.size
+  food = Grid(data.food.width, data.food.height)
+  food.bits = int(binascii.hexlify(payload[offset:]), 16)
+
+  data.food = food
+  data.capsules = capsules
+  data.agentStates = agentStates
+  data._ownedAgents = [True for a in agentStates]
+  data._resetHashes()
+  data.initializeTeamViews()
+  data.redReturned = redReturned
+  data.blueReturned = blueReturned
+  data.score = score
+  data.timeleft = timeleft
+  if moved == NO_AGENT: moved = None
+  data._agentMoved = moved
+  state.agentDistances = distances
+  return state
+
+#######################
+# Parent side: proxies #
+#######################
+
+class SandboxedTeam:
+  """
+  A team module hosted in a worker process.  The worker is started when the
+  team is first used and again after it has been killed.
+  """
+  def __init__(self, factory, memoryLimit=None, quiet=False):
+    self.factory = factory
+    self.memoryLimit = memoryLimit
+    self.quiet = quiet
+    self.process = None
+    self.generation = 0
+    self.creation = None
+    self.layouts = set()
+
+  def createTeam(self, firstIndex, secondIndex, isRed, **args):
+    "Creates the team's agents in the worker and returns their proxies"
+    self.creation = (firstIndex, secondIndex, isRed, args, random.randint(0, 99999999))
+    if self.process is not None:
+      self.call(CREATE, 0, cPickle.dumps(self.creation, 2))
+    return [SandboxedAgent(self, firstIndex), SandboxedAgent(self, secondIndex)]
+
+  def start(self):
+    "Starts a worker, loads the team module in it and creates the team's agents"
+    stderr = None
+    if self.quiet: stderr = open(os.devnull, 'w')
+    script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    self.process = subprocess.Popen([sys.executable, script],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr,
+                                    close_fds=True)
+    if stderr is not None: stderr.close()
+    self.generation += 1
+    self.layouts = set()
+    self.call(LOAD, 0, cPickle.dumps((self.factory, self.memoryLimit, self.quiet), 2))
+    if self.creation is not None:
+      self.call(CREATE, 0, cPickle.dumps(self.creation, 2))
+
+  def kill(self):
+    "Kills the worker; the next call starts a new one"
+    if self.process is None: return
+    try:
+      self.process.kill()
+    except OSError:
+      pass
+    self.process.wait()
+    self.process.stdin.close()
+    self.process.stdout.close()
+    self.process = None
+
+  def close(self):
+    self.kill()
+
+  def call(self, kind, index, payload=''):
+    """
+    Sends a message to the worker and returns its answer as (type, payload).
+    Anything that cuts the call short, a timeout included, kills the worker,
+    since its answer would arrive out of turn.
+    """
+    try:
+      self._send(MESSAGE.pack(kind, index, len(payload)) + payload)
+      kind, index, length = MESSAGE.unpack(self._receive(MESSAGE.size))
+      payload = self._receive(length)
+    except BaseException:
+      self.kill()
+      raise
+    if kind == ERROR:
+      raise SandboxError('%s: %s' % (self.factory, payload.decode('utf-8', 'replace')))
+    return kind, payload
+
+  def _send(self, data):
+    fd = self.process.stdin.fileno()
+    while data:
+      try:
+        data = data[os.write(fd, data):]
+      except OSError, e:
+        if e.errno == errno.EINTR: continue
+        raise SandboxError('%s: the worker has exited' % self.factory)
+
+  def _receive(self, size):
+    # Polls rather than blocking in one read, so that a timeout raised in this
+    # thread from outside (see util.Deadline) is not held up by the wait
+    fd = self.process.stdout.fileno()
+    chunks = []
+    while size > 0:
+      try:
+        ready = select.select([fd], [], [], POLL_INTERVAL)[0]
+        if not ready: continue
+        chunk = os.read(fd, size)
+      except (OSError, select.error), e:
+        if e.args[0] == errno.EINTR: continue
+        raise
+      if not chunk:
+        if self.process.wait() == -signal.SIGXCPU:
+          raise SandboxError('%s: a call ran out of CPU time' % self.factory)
+        raise SandboxError('%s: the worker has exited' % self.factory)
+      chunks.append(chunk)
+      size -= len(chunk)
+    return ''.join(chunks)
+
+class SandboxedAgent:
+  """
+  Stands in for one agent of a SandboxedTeam in Game.run.  cpuTime is the
+  CPU time the agent's last call took in the worker and totalCpuTime the
+  sum over the game.
+  """
+  def __init__(self, team, index):
+    self.team = team
+    self.index = index
+    self.generation = None
+    self.cpuTime = 0.0
+    self.totalCpuTime = 0.0
+    # Teammates share the worker, so a parallel startup sets them up in turn
+    self.startupGroup = team
+
+  def registerInitialState(self, gameState):
+    team = self.team
+    if team.process is None: team.start()
+    self.generation = team.generation
+    self.totalCpuTime = 0.0
+    layoutText = gameState.data.layout.layoutText
+    # A worker keeps the layouts it has seen, so each is only sent once
+    key = tuple(layoutText)
+    if key in team.layouts:
+      layoutText = None
+    payload = cPickle.dumps((key, layoutText, len(gameState.data.agentStates)), 2)
+    self._account(*team.call(REGISTER, self.index, struct.pack('!I', len(payload)) + payload + encodeState(gameState)))
+    team.layouts.add(key)
+
+  def observationFunction(self, gameState):
+    return gameState.makeObservation(self.index)
+
+  def getAction(self, observation):
+    kind, payload = self._call(ACT, encodeState(observation))
+    direction, cpuTime = ACTION_REPLY.unpack(payload)
+    self._recordTime(cpuTime)
+    return DIRECTIONS[direction]
+
+  def final(self, gameState):
+    if self.generation != self.team.generation or self.team.process is None:
+      return # This agent's worker was replaced, so it has nothing to learn
+    self._account(*self._call(FINAL, encodeState(gameState)))
+
+  def _call(self, kind, payload):
+    if self.generation != self.team.generation or self.team.process is None:
+      raise SandboxError('%s: agent %d was lost when its worker was replaced' % (self.team.factory, self.index))
+    return self.team.call(kind, self.index, payload)
+
+  def _account(self, kind, payload):
+    self._recordTime(REPLY.unpack(payload)[0])
+
+  def _recordTime(self, cpuTime):
+    self.cpuTime = cpuTime
+    self.totalCpuTime += cpuTime
+
+def loadSandboxedAgents(isRed, factory, cmdLineArgs, memoryLimit=None, quiet=False):
+  "Like capture.loadAgents, but with the team in a worker process"
+  import capture
+  args = dict()
+  args.update(cmdLineArgs)
+  print "Loading Team (sandboxed):", factory
+  print "Arguments:", args
+  return capture.createAgents(isRed, SandboxedTeam(factory, memoryLimit, quiet).createTeam, args)
+
+########################
+# Worker side: the loop #
+########################
+
+def getCpuTime():
+  if resource is None: return 0.0
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  return usage.ru_utime + usage.ru_stime
+
+def limitCpuTime(used, seconds):
+  "Has the kernel stop the worker (SIGXCPU) once a call has used seconds of CPU"
+  if resource is None: return
+  hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+  soft = int(used + seconds) + 1
+  if hard != resource.RLIM_INFINITY: soft = min(soft, hard)
+  resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def serve(inputFd, outputFd):
+  """
+  Answers the parent's messages until it closes the pipe.  Errors in the
+  team's code are sent back as ERROR messages.
+  """
+  import capture
+
+  class ObservedGameState(capture.GameState):
+    "A decoded observation, which is already all its agent may see"
+    def makeObservation(self, index):
+      return self.deepCopy()
+
+  team = {}
+  agents = {}
+  layouts = {}
+  initialStates = {}
+
+  def receive(size):
+    chunks = []
+    while size > 0:
+      chunk = os.read(inputFd, size)
+      if not chunk: return None
+      chunks.append(chunk)
+      size -= len(chunk)
+    return ''.join(chunks)
+
+  def send(kind, index, payload):
+    data = MESSAGE.pack(kind, index, len(payload)) + payload
+    while data:
+      data = data[os.write(outputFd, data):]
+
+  def observe(index, payload):
+    state = decodeState(payload, initialStates[index])
+    state.__class__ = ObservedGameState
+    return state
+
+  while True:
+    header = receive(MESSAGE.size)
+    if header is None: return
+    kind, index, length = MESSAGE.unpack(header)
+    payload = receive(length)
+    if payload is None: return
+    start = getCpuTime()
+    limitCpuTime(start, kind == ACT and MOVE_CPU_TIME or STARTUP_CPU_TIME)
+    try:
+      if kind == LOAD:
+        factory, memoryLimit, quiet = cPickle.loads(payload)
+        if memoryLimit and resource is not None:
+          resource.setrlimit(resource.RLIMIT_AS, (memoryLimit, memoryLimit))
+        team['createTeam'] = capture.loadTeam(True, factory, 'sandboxedTeam')
+        if team['createTeam'] is None:
+          raise Exception('The team %s could not be loaded' % factory)
+        reply = DONE, ''
+      elif kind == CREATE:
+        firstIndex, secondIndex, isRed, args, seed = cPickle.loads(payload)
+        random.seed(seed)
+        first, second = team['createTeam'](firstIndex, secondIndex, isRed, **args)
+        agents.clear()
+        agents[firstIndex] = first
+        agents[secondIndex] = second
+        reply = DONE, ''
+      elif kind == REGISTER:
+        size = struct.unpack_from('!I', payload)[0]
+        key, layoutText, numAgents = cPickle.loads(payload[4:4 + size])
+        if layoutText is not None:
+          import layout
+          layouts[key] = layout.Layout(list(layoutText))
+        initialState = capture.GameState()
+        initialState.initialize(layouts[key], numAgents)
+        initialState.data.timeleft = 0
+        initialStates[index] = initialState
+        state = decodeState(payload[4 + size:], initialState)
+        agents[index].registerInitialState(state)
+        reply = DONE, ''
+      elif kind == ACT:
+        agent = agents[index]
+        observation = observe(index, payload)
+        if hasattr(agent, 'observationFunction'):
+          observation = agent.observationFunction(observation)
+        action = agent.getAction(observation)
+        reply = ACTION, chr(DIRECTION_CODES[action])
+      elif kind == FINAL:
+        agent = agents[index]
+        if hasattr(agent, 'final'):
+          agent.final(observe(index, payload))
+        reply = DONE, ''
+      else:
+        raise Exception('Unknown message type %d' % kind)
+    except Exception:
+      send(ERROR, index, traceback.format_exc().encode('utf-8', 'replace'))
+      continue
+    kind, payload = reply
+    cpuTime = struct.pack('!d', getCpuTime() - start)
+    send(kind, index, payload + cpuTime)
+
+if __name__ == '__main__':
+  # The pipes to the parent move to new descriptors, so that the team's
+  # prints go to stderr and its reads find nothing, instead of breaking them
+  inputFd, outputFd = os.dup(0), os.dup(1)
+  devnull = os.open(os.devnull, os.O_RDWR)
+  os.dup2(devnull, 0)
+  os.dup2(2, 1)
+  serve(inputFd, outputFd)
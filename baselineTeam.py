@@ -143,7 +143,7 @@ class OffensiveReflexAgent(ReflexCaptureAgent):
 
     if len(foodList) > 0: # This should always be True,  but better safe than sorry
       myPos = successor.getAgentState(self.index).getPosition()
-      minDistance = min([self.getMazeDistance(myPos, food) for food in foodList])
+      minDistance = self.distancer.nearest(myPos, foodList)[1]
       features['distanceToFood'] = minDistance
     return features
 
@@ -174,7 +174,7 @@ class DefensiveReflexAgent(ReflexCaptureAgent):
     invaders = [a for a in enemies if a.isPacman and a.getPosition() != None]
     features['numInvaders'] = len(invaders)
     if len(invaders) > 0:
-      dists = [self.getMazeDistance(myPos, a.getPosition()) for a in invaders]
+      dists = self.distancer.getDistances(myPos, [a.getPosition() for a in invaders])
       features['invaderDistance'] = min(dists)
 
     if action == Directions.STOP: features['stop'] = 1
@@ -73,6 +73,8 @@ DUMP_FOOD_ON_DEATH = True # if we have the gameplay element that dumps dots on d
 
 SCARED_TIME = 40
 
+SUCCESSOR_CACHE_SIZE = 10000 # Default number of successors kept by GameState.newSuccessorCache
+
 def noisyDistance(pos1, pos2):
   return int(util.manhattanDistance(pos1, pos2) + random.choice(SONAR_NOISE_VALUES))
 
@@ -103,17 +105,51 @@ class GameState:
     """
     return AgentRules.getLegalActions( self, agentIndex )
 
-  def generateSuccessor( self, agentIndex, action):
+  def generateSuccessor( self, agentIndex, action, cache=None ):
     """
     Returns the successor state (a GameState object) after the specified agent takes the action.
+
+    With a cache from newSuccessorCache, a successor generated earlier from
+    an identical state may be returned; such successors are shared, so they
+    must not be modified.
+    """
+    if cache is None:
+      return self._generateSuccessor(agentIndex, action)
+    if self._cacheKey is None:
+      self._cacheKey = self._successorKey()
+    key = (self._cacheKey, agentIndex, action)
+    state = cache.get(key, self)
+    if state is None:
+      state = self._generateSuccessor(agentIndex, action)
+      cache.put(key, self, state)
+    return state
+
+  def newSuccessorCache( maxEntries = SUCCESSOR_CACHE_SIZE ):
+    """
+    Returns an empty successor cache to pass to generateSuccessor.  Only the
+    calls given the cache use it, so an agent should keep its own and make a
+    new one each game.  Its hits and misses fields count its lookups.
     """
+    return SuccessorCache(maxEntries)
+  newSuccessorCache = staticmethod( newSuccessorCache )
+
+  def _successorKey( self ):
+    """
+    Everything the successor depends on: GameState equality ignores timeleft,
+    sonar readings and the carried and returned food counts.  States are not
+    changed once agents see them, so the key is computed once per state.
+    """
+    agents = tuple([(s.isPacman, s.numCarrying, s.numReturned) for s in self.data.agentStates])
+    return (hash(self.data), self.data.timeleft, agents, tuple(self.agentDistances))
+
+  def _generateSuccessor( self, agentIndex, action):
     # Copy current state
     state = GameState(self)
 
     # Find appropriate rules for the agent
     AgentRules.applyAction( state, action, agentIndex )
     AgentRules.checkDeath(state, agentIndex)
-    AgentRules.decrementTimer(state.data.agentStates[agentIndex])
+    AgentRules.decrementTimer(state.data.getMutableAgentState(agentIndex))
 
     # Book keeping
     state.data._agentMoved = agentIndex
@@ -132,9 +168,18 @@ class GameState:
     agentState = self.data.agentStates[index]
     ret = agentState.getPosition()
     if ret:
-      return tuple(int(x) for x in ret)
+      return (int(ret[0]), int(ret[1]))
     return ret
 
+  def getAgentCellId(self, index):
+    """
+    Returns the layout cell id (see Layout.getCellId) of the agent if it is
+    observable and on a grid point; otherwise returns None.
+    """
+    configuration = self.data.agentStates[index].configuration
+    if configuration is None: return None
+    return self.data.layout.cellIds.get(configuration.pos)
+
   def getNumAgents( self ):
     return len( self.data.agentStates )
 
@@ -150,7 +195,7 @@ class GameState:
     For the matrix m, m[x][y]=true if there is food in (x,y) that belongs to
     red (meaning red is protecting it, blue is trying to eat it).
     """
-    return halfGrid(self.data.food, red = True)
+    return self.data.redFood.copy()
 
   def getBlueFood(self):
     """
@@ -158,13 +203,29 @@ class GameState:
     For the matrix m, m[x][y]=true if there is food in (x,y) that belongs to
     blue (meaning blue is protecting it, red is trying to eat it).
     """
-    return halfGrid(self.data.food, red = False)
+    return self.data.blueFood.copy()
+
+  def getRedFoodCount(self):
+    "Returns the number of dots left on the red team's side"
+    return self.data.redFoodCount
+
+  def getBlueFoodCount(self):
+    "Returns the number of dots left on the blue team's side"
+    return self.data.blueFoodCount
 
   def getRedCapsules(self):
-    return halfList(self.data.capsules, self.data.food, red = True)
+    return self.data.redCapsules[:]
 
   def getBlueCapsules(self):
-    return halfList(self.data.capsules, self.data.food, red = False)
+    return self.data.blueCapsules[:]
+
+  def getRedFoodReturned(self):
+    "Returns the number of dots the red team has brought home"
+    return self.data.redReturned
+
+  def getBlueFoodReturned(self):
+    "Returns the number of dots the blue team has brought home"
+    return self.data.blueReturned
 
   def getWalls(self):
     """
@@ -210,7 +271,7 @@ class GameState:
     """
     Returns a noisy distance to each agent.
     """
-    if 'agentDistances' in dir(self) :
+    if hasattr(self, 'agentDistances'):
       return self.agentDistances
     else:
       return None
@@ -241,6 +302,7 @@ class GameState:
     """
     Generates a new state by copying information from its predecessor.
     """
+    self._cacheKey = None
     if prevState != None: # Initial state
       self.data = GameStateData(prevState.data)
       self.blueTeam = prevState.blueTeam
@@ -268,9 +330,9 @@ class GameState:
     state = self.deepCopy()
 
     # Adds the sonar signal
-    pos = state.getAgentPosition(index)
-    n = state.getNumAgents()
-    distances = [noisyDistance(pos, state.getAgentPosition(i)) for i in range(n)]
+    positions = [state.getAgentPosition(i) for i in range(state.getNumAgents())]
+    pos = positions[index]
+    distances = [noisyDistance(pos, other) for other in positions]
     state.agentDistances = distances
 
     # Remove states of distant opponents
@@ -282,12 +344,13 @@ class GameState:
       team = self.redTeam
 
     for enemy in otherTeam:
+      enemyX, enemyY = positions[enemy]
       seen = False
-      enemyPos = state.getAgentPosition(enemy)
       for teammate in team:
-        if util.manhattanDistance(enemyPos, state.getAgentPosition(teammate)) <= SIGHT_RANGE:
+        x, y = positions[teammate]
+        if abs(enemyX - x) + abs(enemyY - y) <= SIGHT_RANGE:
           seen = True
-      if not seen: state.data.agentStates[enemy].configuration = None
+      if not seen: state.data.getMutableAgentState(enemy).configuration = None
     return state
 
   def __eq__( self, other ):
@@ -312,6 +375,7 @@ class GameState:
     Creates an initial game state from a layout array (see layout.py).
     """
     self.data.initialize(layout, numAgents)
+    self.data.initializeTeamViews()
     positions = [a.configuration for a in self.data.agentStates]
     self.blueTeam = [i for i,p in enumerate(positions) if not self.isRed(p)]
     self.redTeam = [i for i,p in enumerate(positions) if self.isRed(p)]
@@ -328,17 +392,56 @@ class GameState:
     else:
       return configOrPos.pos[0] < width / 2
 
-def halfGrid(grid, red):
-  halfway = grid.width / 2
-  halfgrid = Grid(grid.width, grid.height, False)
-  if red:    xrange = range(halfway)
-  else:       xrange = range(halfway, grid.width)
+class SuccessorCache:
+  """
+  A bounded map from (state key, agentIndex, action) to successor states.
+
+  Entries live in two generations of at most maxEntries / 2 each.  Lookups
+  that hit the older generation move the entry to the newer one, and when the
+  newer generation fills up the older one is dropped, so the entries that
+  survive are the recently used ones (an approximate LRU that only costs plain
+  dict operations).  Each entry keeps its parent state so that a hash
+  collision can never return the successor of a different state.
+  """
+
+  def __init__( self, maxEntries ):
+    self.maxEntries = maxEntries
+    self.recent = {}
+    self.older = {}
+    self.hits = 0
+    self.misses = 0
+
+  def get( self, key, state ):
+    entry = self.recent.get(key)
+    if entry is None:
+      entry = self.older.pop(key, None)
+      if entry is not None: self._insert(key, entry)
+    if entry is None or not (entry[0] is state or entry[0] == state):
+      self.misses += 1
+      return None
+    self.hits += 1
+    return entry[1]
+
+  def put( self, key, state, successor ):
+    self._insert(key, (state, successor))
 
-  for y in range(grid.height):
-    for x in xrange:
-      if grid[x][y]: halfgrid[x][y] = True
+  def _insert( self, key, entry ):
+    if len(self.recent) >= max(1, self.maxEntries / 2):
+      self.older = self.recent
+      self.recent = {}
+    self.recent[key] = entry
 
-  return halfgrid
+  def clear( self ):
+    self.recent = {}
+    self.older = {}
+
+  def __len__( self ):
+    return len(self.recent) + len(self.older)
+
+def halfGrid(grid, red):
+  halfway = grid.width / 2
+  if red: return grid.maskColumns(0, halfway)
+  else: return grid.maskColumns(halfway, grid.width)
 
 def halfList(l, grid, red):
   halfway = grid.width / 2
@@ -362,45 +465,43 @@ class CaptureRules:
   and how the game starts and ends.
   """
 
-  def __init__(self, quiet = False):
+  def __init__(self, quiet = False, parallelStartup = False):
     self.quiet = quiet
+    self.parallelStartup = parallelStartup
 
   def newGame( self, layout, agents, display, length, muteAgents, catchExceptions ):
     initState = GameState()
     initState.initialize( layout, len(agents) )
     starter = random.randint(0,1)
     print('%s team starts' % ['Red', 'Blue'][starter])
-    game = Game(agents, display, self, startingIndex=starter, muteAgents=muteAgents, catchExceptions=catchExceptions)
+    # Games without graphics skip the display
+    turbo = hasattr(display, 'checkNullDisplay') and display.checkNullDisplay()
+    game = Game(agents, display, self, startingIndex=starter, muteAgents=muteAgents, catchExceptions=catchExceptions,
+                turbo=turbo, parallelStartup=self.parallelStartup)
     game.state = initState
     game.length = length
     game.state.data.timeleft = length
-    if 'drawCenterLine' in dir(display):
+    if hasattr(display, 'drawCenterLine'):
       display.drawCenterLine()
-    self._initBlueFood = initState.getBlueFood().count()
-    self._initRedFood = initState.getRedFood().count()
+    self._initBlueFood = initState.getBlueFoodCount()
+    self._initRedFood = initState.getRedFoodCount()
     return game
 
   def process(self, state, game):
     """
     Checks to see whether it is time to end the game.
     """
-    if 'moveHistory' in dir(game):
+    if hasattr(game, 'moveHistory'):
       if len(game.moveHistory) == game.length:
         state.data._win = True
 
     if state.isOver():
       game.gameOver = True
       if not game.rules.quiet:
-        redCount = 0
-        blueCount = 0
+        redCount = state.getRedFoodReturned()
+        blueCount = state.getBlueFoodReturned()
         foodToWin = (TOTAL_FOOD/2) - MIN_FOOD
-        for index in range(state.getNumAgents()):
-          agentState = state.data.agentStates[index]
-          if index in state.getRedTeamIndices():
-            redCount += agentState.numReturned
-          else:
-            blueCount += agentState.numReturned
-        
+
         if blueCount >= foodToWin:#state.getRedFood().count() == MIN_FOOD:
           print 'The Blue team has returned at least %d of the opponents\' dots.' % foodToWin
         elif redCount >= foodToWin:#state.getBlueFood().count() == MIN_FOOD:
@@ -414,8 +515,8 @@ class CaptureRules:
             print 'The %s team wins by %d points.' % (winner, abs(state.data.score))
 
   def getProgress(self, game):
-    blue = 1.0 - (game.state.getBlueFood().count() / float(self._initBlueFood))
-    red = 1.0 - (game.state.getRedFood().count() / float(self._initRedFood))
+    blue = 1.0 - (game.state.getBlueFoodCount() / float(self._initBlueFood))
+    red = 1.0 - (game.state.getRedFoodCount() / float(self._initRedFood))
     moves = len(self.moveHistory) / float(game.length)
 
     # return the most likely progress indicator, clamped to [0, 1]
@@ -455,10 +556,22 @@ class AgentRules:
     """
     agentState = state.getAgentState(agentIndex)
     conf = agentState.configuration
-    possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
+    layout = state.data.layout
+    possibleActions = Actions.getPossibleActions( conf, layout.walls, layout.moveTable )
     return AgentRules.filterForAllowedActions( agentState, possibleActions)
   getLegalActions = staticmethod( getLegalActions )
 
+  def isLegalAction( state, action, agentIndex ):
+    """
+    Checks an action against the layout's move table without building the
+    list of legal actions (filterForAllowedActions allows every action).
+    """
+    legal = state.data.layout.moveTable.get( state.data.agentStates[agentIndex].configuration.pos )
+    if legal is None:
+      legal = AgentRules.getLegalActions( state, agentIndex )
+    return action in legal
+  isLegalAction = staticmethod( isLegalAction )
+
   def filterForAllowedActions(agentState, possibleActions):
     return possibleActions
   filterForAllowedActions = staticmethod( filterForAllowedActions )
@@ -468,12 +581,11 @@ class AgentRules:
     """
     Edits the state to reflect the results of the action.
     """
-    legal = AgentRules.getLegalActions( state, agentIndex )
-    if action not in legal:
+    if not AgentRules.isLegalAction( state, action, agentIndex ):
       raise Exception("Illegal action " + str(action))
 
     # Update Configuration
-    agentState = state.data.agentStates[agentIndex]
+    agentState = state.data.getMutableAgentState(agentIndex)
     speed = 1.0
     # if agentState.isPacman: speed = 0.5
     vector = Actions.directionToVector( action, speed )
@@ -495,17 +607,12 @@ class AgentRules:
         state.data.scoreChange += score
 
         agentState.numReturned += agentState.numCarrying
+        if isRed: state.data.redReturned += agentState.numCarrying
+        else: state.data.blueReturned += agentState.numCarrying
         agentState.numCarrying = 0
 
-        redCount = 0
-        blueCount = 0
-        for index in range(state.getNumAgents()):
-          agentState = state.data.agentStates[index]
-          if index in state.getRedTeamIndices():
-            redCount += agentState.numReturned
-          else:
-            blueCount += agentState.numReturned
-        if redCount >= (TOTAL_FOOD/2) - MIN_FOOD or blueCount >= (TOTAL_FOOD/2) - MIN_FOOD:
+        foodToWin = (TOTAL_FOOD/2) - MIN_FOOD
+        if state.data.redReturned >= foodToWin or state.data.blueReturned >= foodToWin:
           state.data._win = True
 
 
@@ -516,8 +623,9 @@ class AgentRules:
 
   def consume( position, state, isRed ):
     x,y = position
-    # Eat food
-    if state.data.food[x][y]:
+    # Eat food (a single read of a new grid is cheaper from its bits than its columns)
+    food = state.data.food
+    if food.getBit(food.cellIndex(x, y)):
 
       # blue case is the default
       teamIndicesFunc = state.getBlueTeamIndices
@@ -528,39 +636,38 @@ class AgentRules:
         teamIndicesFunc = state.getRedTeamIndices
 
       # go increase the variable for the pacman who ate this
-      agents = [state.data.agentStates[agentIndex] for agentIndex in teamIndicesFunc()]
-      for agent in agents:
-        if agent.getPosition() == position:
-          agent.numCarrying += 1
+      for agentIndex in teamIndicesFunc():
+        if state.data.agentStates[agentIndex].getPosition() == position:
+          state.data.getMutableAgentState(agentIndex).numCarrying += 1
           break # the above should only be true for one agent...
 
       # do all the score and food grid maintainenace 
       #state.data.scoreChange += score
-      state.data.food = state.data.food.copy()
-      state.data.food[x][y] = False
+      state.data.setFood(x, y, False)
       state.data._foodEaten = position
       #if (isRed and state.getBlueFood().count() == MIN_FOOD) or (not isRed and state.getRedFood().count() == MIN_FOOD):
       #  state.data._win = True
 
     # Eat capsule
-    if isRed: myCapsules = state.getBlueCapsules()
-    else: myCapsules = state.getRedCapsules()
+    if isRed: myCapsules = state.data.blueCapsules
+    else: myCapsules = state.data.redCapsules
     if( position in myCapsules ):
-      state.data.capsules.remove( position )
+      state.data.removeCapsule( position )
       state.data._capsuleEaten = position
 
       # Reset all ghosts' scared timers
       if isRed: otherTeam = state.getBlueTeamIndices()
       else: otherTeam = state.getRedTeamIndices()
       for index in otherTeam:
-        state.data.agentStates[index].scaredTimer = SCARED_TIME
+        state.data.getMutableAgentState(index).scaredTimer = SCARED_TIME
 
   consume = staticmethod( consume )
 
   def decrementTimer(state):
     timer = state.scaredTimer
     if timer == 1:
-      state.configuration.pos = nearestPoint( state.configuration.pos )
+      # Configurations may be shared with earlier states, so replace rather than edit
+      state.configuration = Configuration( nearestPoint( state.configuration.pos ), state.configuration.direction )
     state.scaredTimer = max( 0, timer - 1 )
   decrementTimer = staticmethod( decrementTimer )
 
@@ -609,7 +716,7 @@ class AgentRules:
 
       if walls[x][y]:
         return False
-      if food[x][y]:
+      if food.getBit(food.cellIndex(x, y)):
         return False
 
       # dots need to be on the side where this agent will be a pacman :P
@@ -627,7 +734,6 @@ class AgentRules:
       return True
 
     numToDump = agentState.numCarrying
-    state.data.food = state.data.food.copy()
     foodAdded = []
 
     def genSuccessors(x, y):
@@ -651,7 +757,7 @@ class AgentRules:
       x = int(x)
       y = int(y)
       if (allGood(state, x, y)):
-        state.data.food[x][y] = True
+        state.data.setFood(x, y, True)
         foodAdded.append((x, y))
         numToDump -= 1
 
@@ -666,7 +772,7 @@ class AgentRules:
   dumpFoodFromDeath = staticmethod(dumpFoodFromDeath)
 
   def checkDeath( state, agentIndex):
-    agentState = state.data.agentStates[agentIndex]
+    agentState = state.data.getMutableAgentState(agentIndex)
     if state.isOnRedTeam(agentIndex):
       otherTeam = state.getBlueTeamIndices()
     else:
@@ -678,6 +784,7 @@ class AgentRules:
         ghostPosition = otherAgentState.getPosition()
         if ghostPosition == None: continue
         if manhattanDistance( ghostPosition, agentState.getPosition() ) <= COLLISION_TOLERANCE:
+          otherAgentState = state.data.getMutableAgentState(index)
           # award points to the other team for killing Pacmen
           if otherAgentState.scaredTimer <= 0:
             AgentRules.dumpFoodFromDeath(state, agentState, agentIndex)
@@ -704,6 +811,7 @@ class AgentRules:
         pacPos = otherAgentState.getPosition()
         if pacPos == None: continue
         if manhattanDistance( pacPos, agentState.getPosition() ) <= COLLISION_TOLERANCE:
+          otherAgentState = state.data.getMutableAgentState(index)
           #award points to the other team for killing Pacmen
           if agentState.scaredTimer <= 0:
             AgentRules.dumpFoodFromDeath(state, otherAgentState, agentIndex)
@@ -808,6 +916,17 @@ def readCommand( argv ):
                     help=default('How many episodes are training (suppresses output)'), default=0)
   parser.add_option('-c', '--catchExceptions', action='store_true', default=False,
                     help='Catch exceptions and enforce time limits')
+  parser.add_option('--workers', type='int', default=1,
+                    help=default('Number of processes that play games in parallel (implies -q)'))
+  parser.add_option('--keep-agents', action='store_true', dest='keepAgents', default=False,
+                    help='With --workers, let each worker reuse its agents from game to game')
+  parser.add_option('--sandbox', action='store_true', default=False,
+                    help='Run each team in its own worker process (see agentSandbox.py)')
+  parser.add_option('--agent-memory', type='int', dest='agentMemory', default=0,
+                    help=default('Address space limit of a sandboxed team in megabytes (0 for none)'))
+  parser.add_option('--parallel-startup', action='store_true', dest='parallelStartup', default=False,
+                    help='With -c and --sandbox, set up all agents at once, each within its own startup time '
+                         '(agents drawing random numbers on startup then do so in no fixed order, even with -f)')
 
   options, otherjunk = parser.parse_args(argv)
   assert len(otherjunk) == 0, "Unrecognized options: " + str(otherjunk)
@@ -820,7 +939,7 @@ def readCommand( argv ):
   if options.textgraphics:
     import textDisplay
     args['display'] = textDisplay.PacmanGraphics()
-  elif options.quiet:
+  elif options.quiet or (options.workers > 1 and not options.super_quiet):
     import textDisplay
     args['display'] = textDisplay.NullGraphics()
   elif options.super_quiet:
@@ -836,6 +955,9 @@ def readCommand( argv ):
     __main__.__dict__['_display'] = args['display']
 
 
+  if options.parallelStartup and not (options.catchExceptions and options.sandbox):
+    raise Exception('--parallel-startup needs -c and --sandbox to time each agent\'s startup on its own')
+
   args['redTeamName'] = options.red_name
   args['blueTeamName'] = options.blue_name
 
@@ -855,16 +977,28 @@ def readCommand( argv ):
   if options.numTraining > 0:
     redArgs['numTraining'] = options.numTraining
     blueArgs['numTraining'] = options.numTraining
-  nokeyboard = options.textgraphics or options.quiet or options.numTraining > 0
+  nokeyboard = options.textgraphics or options.quiet or options.numTraining > 0 or options.workers > 1
+  sandbox = None
+  if options.sandbox:
+    import agentSandbox
+    sandbox = (options.agentMemory << 20, options.super_quiet)
   print '\nRed team %s with %s:' % (options.red, redArgs)
-  redAgents = loadAgents(True, options.red, nokeyboard, redArgs)
+  if sandbox is None:
+    redAgents = loadAgents(True, options.red, nokeyboard, redArgs)
+  else:
+    redAgents = agentSandbox.loadSandboxedAgents(True, options.red, redArgs, *sandbox)
   print '\nBlue team %s with %s:' % (options.blue, blueArgs)
-  blueAgents = loadAgents(False, options.blue, nokeyboard, blueArgs)
+  if sandbox is None:
+    blueAgents = loadAgents(False, options.blue, nokeyboard, blueArgs)
+  else:
+    blueAgents = agentSandbox.loadSandboxedAgents(False, options.blue, blueArgs, *sandbox)
   args['agents'] = sum([list(el) for el in zip(redAgents, blueAgents)],[]) # list of agents
 
   numKeyboardAgents = 0
   for index, val in enumerate([options.keys0, options.keys1, options.keys2, options.keys3]):
     if not val: continue
+    if options.workers > 1:
+      raise Exception('Keyboard agents cannot play in worker processes')
     if numKeyboardAgents == 0:
       agent = keyboardAgents.KeyboardAgent(index)
     elif numKeyboardAgents == 1:
@@ -875,20 +1009,9 @@ def readCommand( argv ):
     args['agents'][index] = agent
 
   # Choose a layout
-  import layout
   layouts = []
   for i in range(options.numGames):
-    if options.layout == 'RANDOM':
-      l = layout.Layout(randomLayout().split('\n'))
-    elif options.layout.startswith('RANDOM'):
-      l = layout.Layout(randomLayout(int(options.layout[6:])).split('\n'))
-    elif options.layout.lower().find('capture') == -1:
-      raise Exception( 'You must use a capture layout with capture.py')
-    else:
-      l = layout.getLayout( options.layout )
-    if l == None: raise Exception("The layout " + options.layout + " cannot be found")
-    
-    layouts.append(l)
+    layouts.append(loadCaptureLayout(options.layout))
     
   args['layouts'] = layouts
   args['length'] = options.time
@@ -896,10 +1019,32 @@ def readCommand( argv ):
   args['numTraining'] = options.numTraining
   args['record'] = options.record
   args['catchExceptions'] = options.catchExceptions
+  args['parallelStartup'] = options.parallelStartup
+  if options.workers > 1:
+    args['workers'] = options.workers
+    args['teams'] = [(options.red, redArgs, sandbox), (options.blue, blueArgs, sandbox)]
+    args['keepAgents'] = options.keepAgents
   return args
 
+def loadCaptureLayout(name):
+  """
+  Returns the capture layout called name: a layout file, RANDOM for a new
+  random maze or RANDOM<seed> for the maze of that seed.
+  """
+  import layout
+  if name == 'RANDOM':
+    l = layout.internLayout(randomLayout().split('\n'))
+  elif name.startswith('RANDOM'):
+    l = layout.internLayout(randomLayout(int(name[6:])).split('\n'))
+  elif name.lower().find('capture') == -1:
+    raise Exception( 'You must use a capture layout with capture.py')
+  else:
+    l = layout.getLayout( name )
+  if l == None: raise Exception("The layout " + name + " cannot be found")
+  return l
+
 def randomLayout(seed = None):
-  if not seed:
+  if seed is None:
     seed = random.randint(0,99999999)
   # layout = 'layouts/random%08dCapture.lay' % seed
   # print 'Generating random layout in %s' % layout
@@ -909,14 +1054,8 @@ def randomLayout(seed = None):
 import traceback
 def loadAgents(isRed, factory, textgraphics, cmdLineArgs):
   "Calls agent factories and returns lists of agents"
-  try:
-    if not factory.endswith(".py"):
-      factory += ".py"
-
-    module = imp.load_source('player' + str(int(isRed)), factory)
-  except (NameError, ImportError):
-    print >>sys.stderr, 'Error: The team "' + factory + '" could not be loaded! '
-    traceback.print_exc()
+  createTeamFunc = loadTeam(isRed, factory)
+  if createTeamFunc is None:
     return [None for i in range(2)]
 
   args = dict()
@@ -928,13 +1067,36 @@ def loadAgents(isRed, factory, textgraphics, cmdLineArgs):
   # if textgraphics and factoryClassName.startswith('Keyboard'):
   #   raise Exception('Using the keyboard requires graphics (no text display, quiet or training games)')
 
+  return createAgents(isRed, createTeamFunc, args)
+
+def loadTeam(isRed, factory, moduleName=None):
+  """
+  Loads a team module and returns its createTeam function, or None if it
+  cannot be loaded.  Teams loaded under the same moduleName (by default one
+  per side) replace each other, so loading several teams of a side at once
+  needs a distinct moduleName for each.
+  """
+  if moduleName is None:
+    moduleName = 'player' + str(int(isRed))
+  try:
+    if not factory.endswith(".py"):
+      factory += ".py"
+
+    module = imp.load_source(moduleName, factory)
+  except (NameError, ImportError):
+    print >>sys.stderr, 'Error: The team "' + factory + '" could not be loaded! '
+    traceback.print_exc()
+    return None
+
   try:
-    createTeamFunc = getattr(module, 'createTeam')
+    return getattr(module, 'createTeam')
   except AttributeError:
     print >>sys.stderr, 'Error: The team "' + factory + '" could not be loaded! '
     traceback.print_exc()
-    return [None for i in range(2)]
+    return None
 
+def createAgents(isRed, createTeamFunc, args):
+  "Creates a fresh pair of agents for one side with a loaded createTeam function"
   indexAddend = 0
   if not isRed:
     indexAddend = 1
@@ -959,14 +1121,8 @@ def replayGame( layout, agents, actions, display, length, redTeamName, blueTeamN
 
     display.finish()
 
-def runGames( layouts, agents, display, length, numGames, record, numTraining, redTeamName, blueTeamName, muteAgents=False, catchExceptions=False ):
-
-  rules = CaptureRules()
-  games = []
-
-  if numTraining > 0:
-    print 'Playing %d training games' % numTraining
-
+def playGames( rules, layouts, agents, display, length, numGames, numTraining, muteAgents, catchExceptions ):
+  "Plays the games one after another in this process, yielding each when it ends"
   for i in range( numGames ):
     beQuiet = i < numTraining
     layout = layouts[i]
@@ -980,6 +1136,123 @@ def runGames( layouts, agents, display, length, numGames, record, numTraining, r
         rules.quiet = False
     g = rules.newGame( layout, agents, gameDisplay, length, muteAgents, catchExceptions )
     g.run()
+    yield g
+
+def playGamesInPool( rules, layouts, agents, display, length, numGames, numTraining, teams, workers, keepAgents, muteAgents, catchExceptions ):
+  """
+  Plays the games in a pool of worker processes, yielding them in order.
+
+  Each worker loads the team modules once and, unless keepAgents is set,
+  creates fresh agents for every game, so no agent state carries from one
+  game to the next.  With keepAgents a worker reuses its agents for all of
+  its games, which is only useful for learning agents.  Every game gets its
+  own random seed, drawn here, so a fixed seed (-f) replays the same games
+  for any number of workers.
+
+  The yielded games hold the final state and move history the worker sent
+  back rather than the worker's agents, and were played without graphics.
+  """
+  import multiprocessing, distanceCalculator
+  uniqueLayouts = dict([(id(l), l) for l in layouts]).values()
+  for l in uniqueLayouts:
+    distanceCalculator.publishDistances(l)
+  tasks = [(i, i < numTraining, random.randint(0, sys.maxint)) for i in range(numGames)]
+  pool = multiprocessing.Pool(workers, initGameWorker, (layouts, teams, length, muteAgents, catchExceptions, keepAgents,
+                                                        rules.parallelStartup))
+  try:
+    for i, state, moveHistory, startingIndex, agentCrashed, agentTimeout in pool.imap(playWorkerGame, tasks):
+      g = Game(agents, display, rules, startingIndex=startingIndex, muteAgents=muteAgents, catchExceptions=catchExceptions)
+      state.data.layout = layouts[i]
+      g.state = state
+      g.length = length
+      g.moveHistory = moveHistory
+      g.gameOver = True
+      g.agentCrashed = agentCrashed
+      g.agentTimeout = agentTimeout
+      yield g
+  finally:
+    pool.terminate()
+    pool.join()
+    for l in uniqueLayouts:
+      distanceCalculator.unpublishDistances(l)
+
+# The games and teams of a game worker process, set up by initGameWorker
+workerGames = None
+
+def initGameWorker( layouts, teams, length, muteAgents, catchExceptions, keepAgents, parallelStartup ):
+  "Loads the team modules once when a game worker process starts"
+  global workerGames
+  (redFactory, redArgs, redSandbox), (blueFactory, blueArgs, blueSandbox) = teams
+  redTeam = loadWorkerTeam(True, redFactory, redSandbox)
+  blueTeam = loadWorkerTeam(False, blueFactory, blueSandbox)
+  workerGames = {'layouts': layouts, 'length': length, 'muteAgents': muteAgents,
+                 'catchExceptions': catchExceptions, 'keepAgents': keepAgents, 'parallelStartup': parallelStartup,
+                 'teams': [(True, redTeam, redArgs), (False, blueTeam, blueArgs)],
+                 'agents': None}
+
+def loadWorkerTeam( isRed, factory, sandbox ):
+  """
+  Returns the createTeam function of a game worker's team.  With sandbox,
+  a (memoryLimit, quiet) pair, the team is hosted in a process of its own.
+  """
+  if sandbox is None:
+    return loadTeam(isRed, factory)
+  import agentSandbox
+  memoryLimit, quiet = sandbox
+  return agentSandbox.SandboxedTeam(factory, memoryLimit, quiet).createTeam
+
+def playWorkerGame( task ):
+  """
+  Plays game i of a pool in a worker process and returns what the parent
+  needs to rebuild it: the final state (without its layout, which the parent
+  already has), the move history, the starting index and the crash flags.
+  """
+  i, beQuiet, seed = task
+  import textDisplay
+  random.seed(seed)
+  agents = workerGames['agents']
+  if agents is None or not workerGames['keepAgents']:
+    if None in [createTeamFunc for isRed, createTeamFunc, args in workerGames['teams']]:
+      # Raised here rather than in initGameWorker, which the pool would keep restarting
+      raise Exception('The teams could not be loaded in a game worker')
+    redAgents, blueAgents = [createAgents(isRed, createTeamFunc, dict(args))
+                             for isRed, createTeamFunc, args in workerGames['teams']]
+    agents = sum([list(el) for el in zip(redAgents, blueAgents)], [])
+    workerGames['agents'] = agents
+  rules = CaptureRules(quiet=beQuiet, parallelStartup=workerGames['parallelStartup'])
+  g = rules.newGame( workerGames['layouts'][i], agents, textDisplay.NullGraphics(), workerGames['length'],
+                     workerGames['muteAgents'], workerGames['catchExceptions'] )
+  g.run()
+  state = g.state
+  state.data.layout = None
+  return i, state, g.moveHistory, g.startingIndex, g.agentCrashed, g.agentTimeout
+
+def runGames( layouts, agents, display, length, numGames, record, numTraining, redTeamName, blueTeamName, muteAgents=False, catchExceptions=False, workers=1, teams=None, keepAgents=False, parallelStartup=False ):
+  """
+  Plays numGames games and returns the non-training ones.
+
+  With workers > 1 the games are played in a pool of worker processes (see
+  playGamesInPool), which needs teams, the (factory, args, sandbox) of the
+  red and the blue team (sandbox is None or see loadWorkerTeam).  The games
+  come back in the order they were started, so records and the summary match
+  a sequential run.  With parallelStartup the agents of a game are set up
+  concurrently (see game.Game).
+  """
+
+  rules = CaptureRules(parallelStartup=parallelStartup)
+  games = []
+
+  if numTraining > 0:
+    print 'Playing %d training games' % numTraining
+
+  if workers > 1 and teams is not None:
+    played = playGamesInPool( rules, layouts, agents, display, length, numGames, numTraining, teams, workers, keepAgents, muteAgents, catchExceptions )
+  else:
+    played = playGames( rules, layouts, agents, display, length, numGames, numTraining, muteAgents, catchExceptions )
+
+  for i, g in enumerate(played):
+    beQuiet = i < numTraining
+    layout = layouts[i]
     if not beQuiet: games.append(g)
 
     g.record = None
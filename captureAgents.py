@@ -310,17 +310,23 @@ class ReflexCaptureAgent(CaptureAgent):
   """
   A base class for reflex agents that chooses score-maximizing actions
   """
+  # The agent's own successor cache for the current game, see getSuccessor
+  successorCache = None
 
   def registerInitialState(self, gameState):
     self.start = gameState.getAgentPosition(self.index)
     CaptureAgent.registerInitialState(self, gameState)
 
-    boundary = (gameState.data.layout.width - 2) / 2 if self.red else ((gameState.data.layout.width - 2) / 2) + 1
+    # getSuccessor is called several times per action with the same arguments
+    self.successorCache = gameState.newSuccessorCache()
 
-    self.boundary = []
-    for i in range(1, gameState.data.layout.height - 1):
-        if not gameState.hasWall(boundary, i):
-            self.boundary.append((boundary, i))
+    layout = gameState.data.layout
+    self.boundary = layout.redBoundary[:] if self.red else layout.blueBoundary[:]
+
+    # Distances to the nearest food, boundary cell and capsule, updated as they change
+    self.foodField = distanceCalculator.DistanceField(layout, self.getFood(gameState))
+    self.boundaryField = distanceCalculator.DistanceField(layout, self.boundary)
+    self.capsuleField = distanceCalculator.DistanceField(layout, self.getCapsules(gameState))
 
   def nearbyEnemyPacman(self, currPos, successor):
     enemies_vuln = [successor.getAgentState(i) for i in self.getOpponents(successor)]
@@ -357,11 +363,11 @@ class ReflexCaptureAgent(CaptureAgent):
     """
     Finds the next successor which is a grid position (location tuple).
     """
-    successor = gameState.generateSuccessor(self.index, action)
+    successor = gameState.generateSuccessor(self.index, action, self.successorCache)
     pos = successor.getAgentState(self.index).getPosition()
     if pos != nearestPoint(pos):
       # Only half a grid position was covered
-      return successor.generateSuccessor(self.index, action)
+      return successor.generateSuccessor(self.index, action, self.successorCache)
     else:
       return successor
 
@@ -403,15 +409,16 @@ class OffensiveReflexAgent(ReflexCaptureAgent):
     currPos = successor.getAgentState(self.index).getPosition()
 
     # boundary distance (the more food being carried, the better it is to return)
-    min_boundary = min(self.getMazeDistance(currPos, bound) for bound in self.boundary)
+    min_boundary = self.boundaryField.getDistance(currPos)
     features['returned'] = 50-min_boundary
 
     features['carrying'] = successor.getAgentState(self.index).numCarrying
 
     # food distance
-    food_list = self.getFood(successor).asList()
-    if len(food_list):
-        min_food_dist = min(self.getMazeDistance(currPos, food) for food in food_list)
+    food = self.getFood(successor)
+    if food.count():
+        self.foodField.update(food)
+        min_food_dist = self.foodField.getDistance(currPos)
         features['distanceToFood'] = 50-min_food_dist
 
     food_list = self.getFood(gameState).asList()
@@ -422,7 +429,8 @@ class OffensiveReflexAgent(ReflexCaptureAgent):
     # capsule distance
     capsule_list = self.getCapsules(successor)
     if len(capsule_list) > 0:
-        min_capsule_dist = min(self.getMazeDistance(currPos, cap) for cap in capsule_list)
+        self.capsuleField.update(capsule_list)
+        min_capsule_dist = self.capsuleField.getDistance(currPos)
         features['distanceToCapsule'] = 50-min_capsule_dist
     else:
         features['distanceToCapsule'] = 0
@@ -439,8 +447,7 @@ class OffensiveReflexAgent(ReflexCaptureAgent):
     if len(visible):
         scaredTime = visible[0].scaredTimer
         positions = [agent.getPosition() for agent in visible]
-        closest = min(positions, key=lambda x: self.getMazeDistance(currPos, x))
-        closest_dist = self.getMazeDistance(currPos, closest)
+        closest, closest_dist = self.distancer.nearest(currPos, positions)
 
         if closest_dist <= 5:
             features['GhostDistance'] = closest_dist
@@ -455,8 +462,7 @@ class OffensiveReflexAgent(ReflexCaptureAgent):
     visible_vuln = self.nearbyEnemyPacman(currPos,successor)
     if len(visible_vuln) and not gameState.getAgentState(self.index).isPacman:
         positions = [agent.getPosition() for agent in visible_vuln]
-        closest = min(positions, key=lambda x: self.getMazeDistance(currPos, x))
-        closest_dist = self.getMazeDistance(currPos, closest)
+        closest, closest_dist = self.distancer.nearest(currPos, positions)
         if closest_dist < 4:               
             features['distanceToEnemiesPacMan'] = 50-closest_dist
     else:
@@ -522,7 +528,7 @@ class DefensiveReflexAgent(ReflexCaptureAgent):
     invaders = [a for a in enemies if a.isPacman and a.getPosition() != None]
     features['numInvaders'] = len(invaders)
     if len(invaders) > 0:
-      dists = [self.getMazeDistance(myPos, a.getPosition()) for a in invaders]
+      dists = self.distancer.getDistances(myPos, [a.getPosition() for a in invaders])
       features['invaderDistance'] = min(dists)
 
     if action == Directions.STOP: features['stop'] = 1
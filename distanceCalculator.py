@@ -21,7 +21,18 @@ distancer = Distancer(gameState.data.layout)
 distancer.getDistance( (1,1), (10,10) )
 """
 
-import sys, time, random
+import sys, os, time, random, threading, array, tempfile, heapq
+from game import Grid
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Distancer modes (see Distancer.getMazeDistances)
+ALL_PAIRS = 'allPairs'
+LAZY = 'lazy'
+LANDMARKS = 'landmarks'
 
 class Distancer:
   def __init__(self, layout, default = 10000):
@@ -29,17 +40,32 @@ class Distancer:
     Initialize with Distancer(layout).  Changing default is unnecessary.
     """
     self._distances = None
+    self._lookup = None
+    self._rows = None
+    self._cellIds = layout.cellIds
     self.default = default
     self.dc = DistanceCalculator(layout, self, default)
 
-  def getMazeDistances(self):
-    self.dc.run()
+  def getMazeDistances(self, mode = ALL_PAIRS, maxBytes = None, numLandmarks = None, exact = True):
+    """
+    Switches getDistance from Manhattan to maze distances.  The default
+    mode, ALL_PAIRS, computes (or loads) the whole table up front.  LAZY
+    runs one breadth-first search per source cell the first time it is
+    asked about, keeping at most maxBytes of rows (default
+    LAZY_CACHE_BYTES); use it on mazes too large for the full table.
+
+    LANDMARKS only stores distances from numLandmarks cells (default
+    NUM_LANDMARKS).  Queries are answered by an A* search guided by them,
+    or, with exact = False, by the best route through a landmark, which is
+    never shorter than the true distance but costs only O(numLandmarks).
+    """
+    self.dc.run(mode, maxBytes, numLandmarks, exact)
 
   def getDistance(self, pos1, pos2):
     """
     The getDistance function is the only one you'll need after you create the object.
     """
-    if self._distances == None:
+    if self._distances is None:
       return manhattanDistance(pos1, pos2)
     if isInt(pos1) and isInt(pos2):
       return self.getDistanceOnGrid(pos1, pos2)
@@ -55,14 +81,76 @@ class Distancer:
     return bestDistance
 
   def getDistanceOnGrid(self, pos1, pos2):
-    key = (pos1, pos2)
-    if key in self._distances:
-      return self._distances[key]
-    else:
-      raise Exception("Positions not in grid: " + str(key))
+    cell1 = self._cellIds.get(pos1)
+    cell2 = self._cellIds.get(pos2)
+    if cell1 is None or cell2 is None:
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+    return self._lookup(cell1, cell2)
+
+  def getDistanceById(self, cell1, cell2):
+    """
+    Returns the maze distance between two layout cell ids (see
+    Layout.getCellId).  Requires getMazeDistances() to have been called.
+    """
+    return self._lookup(cell1, cell2)
+
+  def getDistances(self, pos, targets):
+    """
+    Returns the list of distances from pos to each of targets, which is a
+    list of positions or a Grid (taken as targets.asList()).  With a full
+    or lazy table this reads one row rather than looking up each pair.
+    """
+    if isinstance(targets, Grid): targets = targets.asList()
+    cell = self._cellIds.get(pos)
+    if self._rows is None or cell is None:
+      return [self.getDistance(pos, target) for target in targets]
+    cellIds = self._cellIds
+    targetIds = [cellIds.get(target) for target in targets]
+    if None in targetIds:
+      return [self.getDistance(pos, target) for target in targets]
+    row = self._rows[cell]
+    if numpy is not None and isinstance(row, numpy.ndarray):
+      return row[targetIds].tolist()
+    return [row[i] for i in targetIds]
+
+  def nearest(self, pos, targets):
+    """
+    Returns (target, distance) for the target closest to pos, the first
+    one listed on ties, or None if there are no targets.
+    """
+    if isinstance(targets, Grid): targets = targets.asList()
+    if len(targets) == 0: return None
+    distances = self.getDistances(pos, targets)
+    best = 0
+    for i in range(1, len(distances)):
+      if distances[i] < distances[best]: best = i
+    return targets[best], distances[best]
+
+  def kNearest(self, pos, targets, k):
+    """
+    Returns a list of (target, distance) pairs for the k targets closest to
+    pos, nearest first, keeping the listed order on ties.
+    """
+    if isinstance(targets, Grid): targets = targets.asList()
+    distances = self.getDistances(pos, targets)
+    order = sorted(range(len(targets)), key = distances.__getitem__)
+    return [(targets[i], distances[i]) for i in order[:k]]
 
   def isReadyForMazeDistance(self):
-    return self._distances != None
+    return self._distances is not None
+
+  def setDistances(self, distances, lookup = None):
+    """
+    Uses a table from computeDistances (or any object with its item(i, j)
+    method) for maze distances, answering through lookup if given.
+    """
+    self._distances = distances
+    # item() answers with a plain int, so callers never see int16 overflow
+    self._lookup = lookup or distances.item
+    # Rows of a landmark oracle cost a full search, so it answers pair by pair
+    self._rows = None
+    if lookup is None and not isinstance(distances, LandmarkDistances):
+      self._rows = distances
 
 def manhattanDistance(x, y ):
   return abs( x[0] - y[0] ) + abs( x[1] - y[1] )
@@ -88,7 +176,41 @@ def getGrids1D(x):
 # MACHINERY FOR COMPUTING MAZE DISTANCES #
 ##########################################
 
+# Distance between cells that cannot reach each other
+UNREACHABLE = 32767
+
+# Tables are saved under the cache directory so that later processes can map
+# them instead of recomputing them.  Bump the version when the file contents
+# change; set the environment variable to an empty string to turn caching off.
+# By default each user has a directory of their own under the temporary
+# directory, and only tables owned by the user are ever loaded.
+DISTANCE_CACHE_VERSION = 2
+DISTANCE_CACHE_ENV = 'PACMAN_DISTANCE_CACHE'
+
+# The first bytes of every .npy file
+NPY_MAGIC = '\x93NUMPY'
+
+# Tables published for worker processes (see publishDistances) live in
+# memory-backed files, in a private directory under the root made by the
+# publishing process.  Its workers, and any process they start, find it in
+# the environment variable, and check it before the cache directory.
+SHARED_MEMORY_ROOT = '/dev/shm'
+SHARED_DISTANCE_ENV = 'PACMAN_SHARED_DISTANCES'
+
+# What this process has published: its directory, the value the environment
+# variable had before, and how many times each table was published
+publishedTables = {'directory': None, 'environ': None, 'paths': {}}
+
+# Default row budget for each layout's LazyDistances
+LAZY_CACHE_BYTES = 16 * 1024 * 1024
+
+# Default number of landmarks for LandmarkDistances
+NUM_LANDMARKS = 16
+
 distanceMap = {}
+lazyDistanceMap = {}
+landmarkDistanceMap = {}
+distanceMapLock = threading.Lock()
 
 class DistanceCalculator:
   def __init__(self, layout, distancer, default = 10000):
@@ -96,62 +218,576 @@ class DistanceCalculator:
     self.distancer = distancer
     self.default = default
 
-  def run(self):
+  def run(self, mode = ALL_PAIRS, maxBytes = None, numLandmarks = None, exact = True):
     global distanceMap
 
-    if self.layout.walls not in distanceMap:
-      distances = computeDistances(self.layout)
-      distanceMap[self.layout.walls] = distances
+    # Agents set up in parallel wait for the first one rather than repeat its work
+    lookup = None
+    distanceMapLock.acquire()
+    try:
+      if mode == LAZY:
+        distances = self.getLazyDistances(maxBytes)
+      elif mode == LANDMARKS:
+        if numLandmarks is None: numLandmarks = NUM_LANDMARKS
+        key = (self.layout.walls, numLandmarks)
+        if key not in landmarkDistanceMap:
+          landmarkDistanceMap[key] = LandmarkDistances(self.layout, numLandmarks)
+        distances = landmarkDistanceMap[key]
+        if not exact: lookup = distances.approximate
+      elif mode != ALL_PAIRS:
+        raise Exception('Unknown maze distance mode: ' + str(mode))
+      elif self.layout.walls not in distanceMap:
+        distances = loadDistances(self.layout)
+        if distances is None:
+          distances = computeDistances(self.layout)
+          if saveDistances(self.layout, distances):
+            # Map the saved file so this process shares pages with later ones
+            saved = loadDistances(self.layout)
+            if saved is not None: distances = saved
+        distanceMap[self.layout.walls] = distances
+      else:
+        distances = distanceMap[self.layout.walls]
+    finally:
+      distanceMapLock.release()
+
+    self.distancer.setDistances(distances, lookup)
+
+  def getLazyDistances(self, maxBytes):
+    """
+    A full table that is already in memory or saved costs nothing up front,
+    so lazy mode only builds rows itself when there is none.  The rows are
+    shared by every Distancer on the layout; the first caller sets the budget.
+    """
+    walls = self.layout.walls
+    if walls in distanceMap: return distanceMap[walls]
+    if walls not in lazyDistanceMap:
+      distances = loadDistances(self.layout)
+      if distances is None:
+        if maxBytes is None: maxBytes = LAZY_CACHE_BYTES
+        distances = LazyDistances(self.layout, maxBytes)
+      lazyDistanceMap[walls] = distances
+    return lazyDistanceMap[walls]
+
+class DistanceRows:
+  """
+  The stand-in for a numpy matrix when numpy is not installed: one
+  array('h') row per cell, with the item(i, j) lookup numpy provides.
+  """
+  def __init__(self, rows):
+    self.rows = rows
+    self.shape = (len(rows), len(rows) and len(rows[0]))
+
+  def item(self, i, j):
+    return self.rows[i][j]
+
+  def __getitem__(self, i):
+    return self.rows[i]
+
+class HalfDistances:
+  """
+  The distance table of a point-symmetric layout (see Layout.isSymmetric),
+  storing only the rows of the first half of the cell ids.  The mirror of
+  cell i is cell n-1-i and mirroring keeps distances, so
+  d(i, j) = d(n-1-i, n-1-j) answers for the other half.
+  """
+  def __init__(self, half, numCells):
+    self.half = half
+    self.numRows = half.shape[0]
+    self.last = numCells - 1
+    self.shape = (numCells, numCells)
+
+  def item(self, i, j):
+    if i < self.numRows: return self.half.item(i, j)
+    return self.half.item(self.last - i, self.last - j)
+
+  def __getitem__(self, i):
+    if i < self.numRows: return self.half[i]
+    return self.half[self.last - i][::-1]
+
+def getNumDistanceRows(layout):
+  "Returns how many rows of a layout's distance table are stored"
+  numCells = layout.getNumCells()
+  if layout.isSymmetric: return (numCells + 1) // 2
+  return numCells
+
+def wrapDistances(layout, matrix):
+  "Returns the table for the stored rows in matrix"
+  if layout.isSymmetric: return HalfDistances(matrix, layout.getNumCells())
+  return matrix
+
+class LazyDistances:
+  """
+  Maze distances computed one source row at a time, with the item(i, j)
+  lookup of the full table.  Rows live in a cache of about maxBytes,
+  evicting the least recently used (approximately: rows are kept in two
+  generations and the older one is dropped when the newer fills up).
+  Distances are symmetric, so a row cached for either cell answers, and
+  on a point-symmetric layout only the first half's rows are ever built.
+  """
+  def __init__(self, layout, maxBytes):
+    self.layout = layout
+    numCells = layout.getNumCells()
+    self.shape = (numCells, numCells)
+    self.numRows = getNumDistanceRows(layout)
+    self.last = numCells - 1
+    rowBytes = 2 * max(numCells, 1)
+    self.maxRows = max(2, maxBytes // rowBytes)
+    self.recent = {}
+    self.older = {}
+    self.hits = 0
+    self.misses = 0
+
+  def item(self, i, j):
+    if i >= self.numRows: i, j = self.last - i, self.last - j
+    row = self.recent.get(i)
+    if row is not None: return row[j]
+    if j < self.numRows:
+      row = self.recent.get(j)
+      if row is not None: return row[i]
+      if j in self.older and i not in self.older: return self[j][i]
+    return self[i][j]
+
+  def __getitem__(self, i):
+    "Returns the row of distances from cell id i"
+    if i >= self.numRows: return self[self.last - i][::-1]
+    row = self.recent.get(i)
+    if row is not None:
+      self.hits += 1
+      return row
+    row = self.older.pop(i, None)
+    if row is not None:
+      self.hits += 1
+    else:
+      self.misses += 1
+      row = array.array('h', computeDistancesFrom(self.layout, i))
+    self._insert(i, row)
+    return row
+
+  def _insert(self, i, row):
+    if len(self.recent) >= self.maxRows // 2:
+      self.older = self.recent
+      self.recent = {}
+    self.recent[i] = row
+
+  def getNumCachedRows(self):
+    return len(self.recent) + len(self.older)
+
+  def clear(self):
+    self.recent = {}
+    self.older = {}
+
+class LandmarkDistances:
+  """
+  Maze distances from a few landmark cells, chosen far apart, which bound
+  every other distance by the triangle inequality:
+
+    |d(L, i) - d(L, j)| <= d(i, j) <= d(i, L) + d(L, j)
+
+  item(i, j) runs A* from i to j with the best lower bound as its
+  heuristic, which is exact.  approximate(i, j) returns the best upper
+  bound.  Storage is O(numLandmarks) per cell instead of O(cells).
+  """
+  def __init__(self, layout, numLandmarks):
+    self.layout = layout
+    numCells = layout.getNumCells()
+    self.shape = (numCells, numCells)
+    self.landmarks = []
+    self.rows = []
+    # Farthest-point selection: each landmark is the cell farthest from all
+    # the earlier ones, which makes for tight bounds on the open edges.
+    closest = [UNREACHABLE] * numCells
+    candidate = 0
+    while candidate is not None and len(self.landmarks) < min(numLandmarks, numCells):
+      row = array.array('h', computeDistancesFrom(layout, candidate))
+      self.landmarks.append(candidate)
+      self.rows.append(row)
+      candidate = None
+      farthest = 0
+      for cell in range(numCells):
+        if row[cell] < closest[cell]: closest[cell] = row[cell]
+        # Cells no landmark reaches (a walled-off pocket) come first
+        if closest[cell] > farthest:
+          candidate, farthest = cell, closest[cell]
+
+  def getBounds(self, i, j):
+    "Returns the (lower, upper) bounds the landmarks give on d(i, j)"
+    lower, upper = 0, UNREACHABLE
+    for row in self.rows:
+      di, dj = row[i], row[j]
+      if di == UNREACHABLE or dj == UNREACHABLE:
+        if di != dj: return UNREACHABLE, UNREACHABLE
+        continue
+      if abs(di - dj) > lower: lower = abs(di - dj)
+      if di + dj < upper: upper = di + dj
+    return lower, upper
+
+  def approximate(self, i, j):
+    if i == j: return 0
+    return self.getBounds(i, j)[1]
+
+  def item(self, i, j):
+    if i == j: return 0
+    lower, upper = self.getBounds(i, j)
+    if lower == upper: return lower
+    return self.search(i, j)
+
+  def search(self, i, j):
+    "A* from i to j using the landmark lower bounds, which are consistent"
+    targets = [row[j] for row in self.rows]
+    rows = zip(self.rows, targets)
+    neighborIds = self.layout.neighborIds
+    best = {i: 0}
+    closed = set()
+    fringe = [(0, 0, i)]
+    while fringe:
+      f, g, node = heapq.heappop(fringe)
+      if node == j: return g
+      if node in closed: continue
+      closed.add(node)
+      g += 1
+      for other in neighborIds[node]:
+        if other in closed or best.get(other, UNREACHABLE) <= g: continue
+        best[other] = g
+        h = 0
+        for row, target in rows:
+          bound = abs(row[other] - target)
+          if bound > h: h = bound
+        heapq.heappush(fringe, (g + h, g, other))
+    return UNREACHABLE
+
+  def __getitem__(self, i):
+    "Returns the row of distances from cell id i, by a fresh search"
+    return array.array('h', computeDistancesFrom(self.layout, i))
+
+class DistanceField:
+  """
+  For every cell, the maze distance to the nearest of a set of source cells
+  (UNREACHABLE if none can be reached), such as the remaining food, the home
+  boundary or the capsules.  update() moves the field to a new set of
+  sources by only repairing what changed:
+
+    * a new source lowers distances with a search that stops where they
+      do not improve;
+    * a removed source raises only the cells it was nearest to, which are
+      then refilled from their neighbours outside that region.
+
+  Sources can be given as a list of positions or as a Grid; consecutive
+  grids are compared with XOR, so following the food grid from one state
+  to the next costs nothing for the cells that did not change.
+  """
+  def __init__(self, layout, sources = ()):
+    self.layout = layout
+    self.field = array.array('h', [UNREACHABLE]) * layout.getNumCells()
+    self.sources = set()
+    self._grid = None
+    self.update(sources)
+
+  def update(self, sources):
+    "Makes sources (a list of positions or a Grid) the field's sources"
+    layout = self.layout
+    if isinstance(sources, Grid):
+      if self._grid is None:
+        changed = sources
+      elif sources.bits is self._grid.bits:
+        return
+      else:
+        changed = sources ^ self._grid
+      self._grid = sources
+      bitCells = layout.bitCells
+      for bit in changed.bitIndices():
+        cell = bitCells[bit]
+        if cell < 0: continue
+        if sources.getBit(bit): self.addSource(cell)
+        else: self.removeSource(cell)
     else:
-      distances = distanceMap[self.layout.walls]
+      self._grid = None
+      cells = set([layout.getCellId(pos) for pos in sources])
+      cells.discard(None)
+      for cell in self.sources - cells:
+        self.removeSource(cell)
+      for cell in cells - self.sources:
+        self.addSource(cell)
 
-    self.distancer._distances = distances
+  def addSource(self, cell):
+    if cell in self.sources: return
+    self.sources.add(cell)
+    field = self.field
+    neighborIds = self.layout.neighborIds
+    field[cell] = 0
+    frontier = [cell]
+    depth = 0
+    while frontier:
+      depth += 1
+      nextFrontier = []
+      for node in frontier:
+        for other in neighborIds[node]:
+          if depth < field[other]:
+            field[other] = depth
+            nextFrontier.append(other)
+      frontier = nextFrontier
+
+  def removeSource(self, cell):
+    if cell not in self.sources: return
+    self.sources.remove(cell)
+    field = self.field
+    neighborIds = self.layout.neighborIds
+    # The cells cell may have been nearest to: every cell on a shortest path
+    # from cell to one of them is one too, so a search from cell finds them all.
+    region = [cell]
+    seen = set(region)
+    frontier = [cell]
+    depth = 0
+    while frontier:
+      depth += 1
+      nextFrontier = []
+      for node in frontier:
+        for other in neighborIds[node]:
+          if field[other] == depth and other not in seen:
+            seen.add(other)
+            nextFrontier.append(other)
+      region.extend(nextFrontier)
+      frontier = nextFrontier
+    for node in region:
+      field[node] = UNREACHABLE
+    # Refill the region from the unchanged cells around it
+    fringe = []
+    for node in region:
+      best = UNREACHABLE
+      for other in neighborIds[node]:
+        if field[other] + 1 < best: best = field[other] + 1
+      if best < UNREACHABLE:
+        fringe.append((best, node))
+    heapq.heapify(fringe)
+    while fringe:
+      distance, node = heapq.heappop(fringe)
+      if distance >= field[node]: continue
+      field[node] = distance
+      for other in neighborIds[node]:
+        if distance + 1 < field[other]:
+          heapq.heappush(fringe, (distance + 1, other))
+
+  def getDistance(self, pos):
+    "Returns the distance from pos to the nearest source"
+    cell = self.layout.getCellId(pos)
+    if cell is None:
+      raise Exception("Position not in grid: " + str(pos))
+    return self.field[cell]
+
+  def getDistanceById(self, cell):
+    return self.field[cell]
+
+  def copy(self):
+    field = DistanceField(self.layout)
+    field.field = self.field[:]
+    field.sources = set(self.sources)
+    field._grid = self._grid
+    return field
 
 def computeDistances(layout):
-    "Runs UCS to all other positions from each position"
-    distances = {}
-    allNodes = layout.walls.asList(False)
-    for source in allNodes:
-        dist = {}
-        closed = {}
-        for node in allNodes:
-            dist[node] = sys.maxint
-        import util
-        queue = util.PriorityQueue()
-        queue.push(source, 0)
-        dist[source] = 0
-        while not queue.isEmpty():
-            node = queue.pop()
-            if node in closed:
-                continue
-            closed[node] = True
-            nodeDist = dist[node]
-            adjacent = []
-            x, y = node
-            if not layout.isWall((x,y+1)):
-                adjacent.append((x,y+1))
-            if not layout.isWall((x,y-1)):
-                adjacent.append((x,y-1) )
-            if not layout.isWall((x+1,y)):
-                adjacent.append((x+1,y) )
-            if not layout.isWall((x-1,y)):
-                adjacent.append((x-1,y))
-            for other in adjacent:
-                if not other in dist:
-                    continue
-                oldDist = dist[other]
-                newDist = nodeDist+1
-                if newDist < oldDist:
-                    dist[other] = newDist
-                    queue.push(other, newDist)
-        for target in allNodes:
-            distances[(target, source)] = dist[target]
-    return distances
-
-
-def getDistanceOnGrid(distances, pos1, pos2):
-    key = (pos1, pos2)
-    if key in distances:
-      return distances[key]
-    return 100000
+    """
+    Runs a breadth-first search from each position.  Returns a square int16
+    matrix indexed by layout cell id, distances[source, target], holding
+    UNREACHABLE for cells that are walled off from each other.  Without
+    numpy the matrix is a DistanceRows.  On a point-symmetric layout only
+    the first half's rows are searched and stored, in a HalfDistances.
+    """
+    numCells = layout.getNumCells()
+    numRows = getNumDistanceRows(layout)
+    if numpy is not None:
+        distances = numpy.empty((numRows, numCells), dtype = numpy.int16)
+        for source in range(numRows):
+            distances[source] = computeDistancesFrom(layout, source)
+    else:
+        rows = []
+        for source in range(numRows):
+            rows.append(array.array('h', computeDistancesFrom(layout, source)))
+        distances = DistanceRows(rows)
+    return wrapDistances(layout, distances)
+
+def getDistanceCacheDir():
+  """
+  Returns the directory for saved distance tables, or None if the cache is
+  turned off or numpy (needed to map the files) is missing.
+  """
+  if numpy is None: return None
+  directory = os.environ.get(DISTANCE_CACHE_ENV)
+  if directory is None:
+    name = 'pacman-distances'
+    if hasattr(os, 'getuid'): name += '-%d' % os.getuid()
+    directory = os.path.join(tempfile.gettempdir(), name)
+    # Anyone can create a directory there, so one we do not own is not used
+    if os.path.exists(directory) and not isPrivateDirectory(directory): return None
+  return directory or None
+
+def isOwnFile(path):
+  "Returns whether this user owns path (always true where there are no user ids)"
+  if not hasattr(os, 'getuid'): return True
+  try:
+    return os.stat(path).st_uid == os.getuid()
+  except OSError:
+    return False
+
+def isPrivateDirectory(path):
+  "Returns whether path is a directory of this user's that no one else can write to"
+  if not os.path.isdir(path) or not isOwnFile(path): return False
+  return not hasattr(os, 'getuid') or os.stat(path).st_mode & 022 == 0
 
+def getSharedDistanceDir():
+  "Returns the directory of the tables published for this process, or None if there is none"
+  if numpy is None: return None
+  directory = os.environ.get(SHARED_DISTANCE_ENV)
+  if not directory or not isPrivateDirectory(directory): return None
+  return directory
+
+def getDistanceCachePath(layout, directory = None):
+  if directory is None:
+    directory = getDistanceCacheDir()
+    if directory is None: return None
+  name = 'distances-v%d-%s.npy' % (DISTANCE_CACHE_VERSION, layout.wallFingerprint)
+  return os.path.join(directory, name)
+
+def loadDistances(layout):
+  """
+  Returns the published or saved distance table for layout, memory-mapped
+  read-only, or None if there is none or it does not fit the layout.
+  """
+  for directory in [getSharedDistanceDir(), getDistanceCacheDir()]:
+    if directory is None: continue
+    distances = loadDistanceFile(layout, getDistanceCachePath(layout, directory))
+    if distances is not None:
+      return distances
+  return None
+
+def loadDistanceFile(layout, path):
+  """
+  Maps the table saved at path, or returns None if there is none, it is not
+  this user's, or it is not a plain .npy file of the layout's shape.
+  """
+  if not os.path.exists(path) or not isOwnFile(path): return None
+  try:
+    with open(path, 'rb') as f:
+      if f.read(len(NPY_MAGIC)) != NPY_MAGIC: return None
+    distances = numpy.load(path, mmap_mode = 'r', allow_pickle = False)
+  except (IOError, OSError, ValueError):
+    return None
+  shape = (getNumDistanceRows(layout), layout.getNumCells())
+  if distances.shape != shape or distances.dtype != numpy.int16:
+    return None
+  return wrapDistances(layout, distances)
+
+def saveDistances(layout, distances, directory = None):
+  """
+  Saves a table from computeDistances to the cache directory, or to the
+  given directory, and returns whether it was saved.  The file is written
+  under a temporary name and renamed into place, so readers never see a
+  partial table.  Errors are ignored: the cache is only an optimization.
+  """
+  path = getDistanceCachePath(layout, directory)
+  if isinstance(distances, HalfDistances): distances = distances.half
+  if path is None or not isinstance(distances, numpy.ndarray): return False
+  directory = os.path.dirname(path)
+  tmpPath = None
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory, 0700)
+    fd, tmpPath = tempfile.mkstemp(suffix = '.tmp', dir = directory)
+    tmpFile = os.fdopen(fd, 'wb')
+    try:
+      numpy.save(tmpFile, distances)
+    finally:
+      tmpFile.close()
+    os.rename(tmpPath, path)
+    return True
+  except (IOError, OSError):
+    pass
+  if tmpPath is not None:
+    try:
+      os.remove(tmpPath)
+    except OSError:
+      pass
+  return False
+
+def publishDistances(layout):
+  """
+  Makes layout's distance table available to other processes in shared
+  memory, computing it if no cached copy exists, and returns whether it is
+  published.  A parent process calls this before starting game workers;
+  each worker's Distancer then maps the one copy read-only instead of
+  holding its own.  Every run publishes to a directory of its own, so
+  concurrent runs never share or remove each other's tables.
+  """
+  if numpy is None or not os.path.isdir(SHARED_MEMORY_ROOT): return False
+  directory = publishedTables['directory']
+  if directory is None:
+    try:
+      directory = tempfile.mkdtemp(prefix = 'pacman-distances-', dir = SHARED_MEMORY_ROOT)
+    except (IOError, OSError):
+      return False
+    publishedTables['directory'] = directory
+    publishedTables['environ'] = os.environ.get(SHARED_DISTANCE_ENV)
+    os.environ[SHARED_DISTANCE_ENV] = directory
+  paths = publishedTables['paths']
+  path = getDistanceCachePath(layout, directory)
+  if path not in paths:
+    distances = loadDistances(layout)
+    if distances is None:
+      distances = computeDistances(layout)
+    if not saveDistances(layout, distances, directory):
+      if not paths: endPublishing()
+      return False
+  paths[path] = paths.get(path, 0) + 1
+  return True
+
+def unpublishDistances(layout):
+  """
+  Undoes one publishDistances of layout's table by this process, removing
+  the table once it is no longer published.  Processes that mapped it keep
+  their copy.
+  """
+  directory = publishedTables['directory']
+  if directory is None: return
+  paths = publishedTables['paths']
+  path = getDistanceCachePath(layout, directory)
+  if path not in paths: return
+  paths[path] -= 1
+  if paths[path] > 0: return
+  del paths[path]
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+  if not paths: endPublishing()
+
+def endPublishing():
+  "Removes this process's empty publishing directory and restores the environment"
+  try:
+    os.rmdir(publishedTables['directory'])
+  except OSError:
+    pass
+  if publishedTables['environ'] is None:
+    os.environ.pop(SHARED_DISTANCE_ENV, None)
+  else:
+    os.environ[SHARED_DISTANCE_ENV] = publishedTables['environ']
+  publishedTables['directory'] = None
+  publishedTables['environ'] = None
+
+def computeDistancesFrom(layout, source):
+    """
+    Returns the list of maze distances from cell id source to every cell id,
+    found by a breadth-first search, since every move costs 1.
+    """
+    neighborIds = layout.neighborIds
+    dist = [UNREACHABLE] * layout.getNumCells()
+    dist[source] = 0
+    frontier = [source]
+    depth = 0
+    while frontier:
+        depth += 1
+        nextFrontier = []
+        for node in frontier:
+            for other in neighborIds[node]:
+                if dist[other] == UNREACHABLE:
+                    dist[other] = depth
+                    nextFrontier.append(other)
+        frontier = nextFrontier
+    return dist
@@ -22,8 +22,11 @@
 
 from util import *
 import time, os
+import threading, thread
+import binascii, itertools
 import traceback
 import sys
+import random
 
 #######################
 # Parts worth reading #
@@ -161,10 +164,17 @@ class AgentState:
 
 class Grid:
     """
-    A 2-dimensional array of objects backed by a list of lists.  Data is accessed
+    A 2-dimensional array of booleans backed by a packed bitset.  Data is accessed
     via grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
     y vertical and the origin (0,0) in the bottom left corner.
 
+    Cell (x,y) is bit x * height + y of the integer self.bits.  Python integers
+    are immutable, so copies share the same bits until one of them is written,
+    count() and asList() only visit set cells, and grids of the same size can be
+    combined with &, |, ^ and - (and-not).  Reading grid[x][y] goes through
+    lists of the columns' cells (see GridColumn), unpacked on the first read
+    and kept up to date as the bits change.
+
     The __str__ method constructs an output that is oriented like a pacman board.
     """
     def __init__(self, width, height, initialValue=False, bitRepresentation=None):
@@ -173,58 +183,169 @@ class Grid:
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self._columns = None
+        self.bits = 0
+        self._listCache = None
+        if initialValue:
+            self.bits = (1 << (width * height)) - 1
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
     def __getitem__(self, i):
-        return self.data[i]
+        try:
+            return self._columns[i]
+        except TypeError:
+            if self._columns is not None: raise
+        columns = [GridColumn(self, x) for x in range(self.width)]
+        self.__dict__['_columns'] = columns
+        self._fillColumns()
+        return columns[i]
+
+    def _fillColumns(self):
+        width, height = self.width, self.height
+        # Bytes of the bits, lowest first, each expanded to its eight cells
+        numBytes = (width * height + 7) / 8
+        data = bytearray(binascii.unhexlify('%0*x' % (2 * numBytes, self.bits))[::-1])
+        cells = list(itertools.chain.from_iterable(map(_BYTE_CELLS.__getitem__, data)))
+        for x, column in enumerate(self._columns):
+            list.__setitem__(column, slice(None), cells[x * height:(x + 1) * height])
+
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        if name == 'bits' and self.__dict__.get('_columns') is not None:
+            # Columns already handed out must read the new bits too
+            self._fillColumns()
 
     def __setitem__(self, key, item):
-        self.data[key] = item
+        column = self[key]
+        for y in range(self.height):
+            column[y] = item[y]
+
+    def __iter__(self):
+        for x in range(self.width):
+            yield self[x]
 
     def __str__(self):
-        out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out = [[str(self[x][y])[0] for x in range(self.width)] for y in range(self.height)]
         out.reverse()
         return '\n'.join([''.join(x) for x in out])
 
     def __eq__(self, other):
         if other == None: return False
-        return self.data == other.data
+        return self.bits == other.bits and self.width == other.width and self.height == other.height
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        # return hash(str(self))
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        # Same value as the old list-of-lists hash, which built this integer bit by bit
+        return hash(self.bits)
+
+    def __getstate__(self):
+        "Pickles the grid without its unpacked columns"
+        state = self.__dict__.copy()
+        state['_columns'] = None
+        return state
+
+    def _combine(self, bits):
+        g = Grid(self.width, self.height)
+        g.bits = bits
+        return g
+
+    def __and__(self, other):
+        return self._combine(self.bits & other.bits)
+
+    def __or__(self, other):
+        return self._combine(self.bits | other.bits)
+
+    def __xor__(self, other):
+        return self._combine(self.bits ^ other.bits)
+
+    def __sub__(self, other):
+        return self._combine(self.bits & ~other.bits)
+
+    def maskColumns(self, xStart, xEnd):
+        """
+        Returns a copy of this grid with every cell outside columns
+        xStart <= x < xEnd cleared.
+        """
+        xStart, xEnd = max(xStart, 0), min(xEnd, self.width)
+        if xEnd <= xStart: return Grid(self.width, self.height)
+        mask = ((1 << ((xEnd - xStart) * self.height)) - 1) << (xStart * self.height)
+        return self._combine(self.bits & mask)
+
+    def pointReflection(self):
+        """
+        Returns this grid turned half way round its centre, so that (x,y)
+        moves to (width-1-x, height-1-y).  That is bit i moving to bit
+        width*height-1-i, so it is the bit string read backwards.
+        """
+        size = self.width * self.height
+        digits = bin(self.bits)[2:].zfill(size)
+        return self._combine(int(digits[::-1], 2))
 
     def copy(self):
         g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g.bits = self.bits
+        # The copy has the same bits, so the answer asList remembers holds for it too
+        g._listCache = self._listCache
         return g
 
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
-        g.data = self.data
-        return g
+        return self.copy()
 
     def count(self, item =True ):
-        return sum([x.count(item) for x in self.data])
+        ones = bin(self.bits).count('1')
+        if item: return ones
+        return self.width * self.height - ones
 
     def asList(self, key = True):
-        list = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key: list.append( (x,y) )
-        return list
+        # Grids are read far more often than written, so remember the last answer
+        cache = self._listCache
+        if cache is not None and cache[0] is self.bits and cache[1] == key:
+            return cache[2][:]
+        height = self.height
+        list = [(i // height, i % height) for i in self.bitIndices(key)]
+        self._listCache = (self.bits, key, list)
+        return list[:]
+
+    def cellIndex(self, x, y):
+        "Returns the index of the bit that stores (x,y)"
+        return x * self.height + y
+
+    def getBit(self, index):
+        return self.bits & (1 << index) != 0
+
+    def setBit(self, index, value):
+        bits = self.bits
+        if value:
+            bits |= 1 << index
+        else:
+            bits &= ~(1 << index)
+        # Only one cell changed, so the columns need not be unpacked again
+        self.__dict__['bits'] = bits
+        columns = self._columns
+        if columns is not None:
+            list.__setitem__(columns[index // self.height], index % self.height, bool(value))
+
+    def bitIndices(self, key = True):
+        """
+        Returns the bit indices (see cellIndex) of the cells equal to key, lowest
+        first, which is the x-major, y-minor order asList has always used.
+        """
+        bits = self.bits
+        if not key:
+            bits = ~bits & ((1 << (self.width * self.height)) - 1)
+        digits = bin(bits)[:1:-1]
+        indices = []
+        i = digits.find('1')
+        while i >= 0:
+            indices.append(i)
+            i = digits.find('1', i + 1)
+        return indices
 
     def packBits(self):
         """
@@ -236,8 +357,7 @@ class Grid:
         currentInt = 0
         for i in range(self.height * self.width):
             bit = self.CELLS_PER_INT - (i % self.CELLS_PER_INT) - 1
-            x, y = self._cellIndexToPosition(i)
-            if self[x][y]:
+            if (self.bits >> i) & 1:
                 currentInt += 2 ** bit
             if (i + 1) % self.CELLS_PER_INT == 0:
                 bits.append(currentInt)
@@ -258,8 +378,10 @@ class Grid:
         for packed in bits:
             for bit in self._unpackInt(packed, self.CELLS_PER_INT):
                 if cell == self.width * self.height: break
-                x, y = self._cellIndexToPosition(cell)
-                self[x][y] = bit
+                if bit:
+                    self.bits |= 1 << cell
+                else:
+                    self.bits &= ~(1 << cell)
                 cell += 1
 
     def _unpackInt(self, packed, size):
@@ -274,6 +396,37 @@ class Grid:
                 bools.append(False)
         return bools
 
+# The eight cells of each byte value, lowest bit first
+_BYTE_CELLS = tuple([tuple([(byte >> i) & 1 == 1 for i in range(8)]) for byte in range(256)])
+
+class GridColumn(list):
+    """
+    The cells of column x of a Grid as a list of booleans, which the grid
+    keeps up to date, so that reading grid[x][y] is a plain list lookup.
+    Writing column[y] writes the grid's cell; the list cannot be changed in
+    any other way.  Copies of a column are plain lists.
+    """
+    def __init__(self, grid, x):
+        list.__init__(self)
+        self.grid = grid
+        self.x = x
+
+    def __setitem__(self, y, value):
+        grid = self.grid
+        if isinstance(y, slice): raise TypeError('Grid columns cannot be sliced')
+        if y < 0: y += grid.height
+        if not 0 <= y < grid.height: raise IndexError('Grid column index out of range')
+        grid.setBit(self.x * grid.height + y, value)
+
+    def _readOnly(self, *args):
+        raise TypeError('Grid columns can only be changed one cell at a time')
+
+    append = extend = insert = pop = remove = reverse = sort = _readOnly
+    __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _readOnly
+
+    def __reduce__(self):
+        return list, (list(self),)
+
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
         return bitRep
@@ -329,7 +482,15 @@ class Actions:
         return (dx * speed, dy * speed)
     directionToVector = staticmethod(directionToVector)
 
-    def getPossibleActions(config, walls):
+    def getPossibleActions(config, walls, moveTable = None):
+        """
+        Returns the actions allowed from config.  moveTable, if given, is the
+        result of buildMoveTable(walls) and answers grid positions directly.
+        """
+        if moveTable is not None:
+            actions = moveTable.get(config.pos)
+            if actions is not None: return list(actions)
+
         possible = []
         x, y = config.pos
         x_int, y_int = int(x + 0.5), int(y + 0.5)
@@ -348,6 +509,36 @@ class Actions:
 
     getPossibleActions = staticmethod(getPossibleActions)
 
+    def buildMoveTable(walls):
+        """
+        Returns a dict from every open grid position to the tuple of actions
+        getPossibleActions allows there, in the same order.  Positions off the
+        grid count as walls.
+        """
+        table = {}
+        for x, y in walls.asList(False):
+            possible = []
+            for dir, vec in Actions._directionsAsList:
+                dx, dy = vec
+                next_x, next_y = x + dx, y + dy
+                if next_x < 0 or next_x >= walls.width: continue
+                if next_y < 0 or next_y >= walls.height: continue
+                if not walls[next_x][next_y]: possible.append(dir)
+            table[(x, y)] = tuple(possible)
+        return table
+    buildMoveTable = staticmethod(buildMoveTable)
+
+    def buildNeighborTable(moveTable):
+        """
+        Returns a dict from every position of moveTable to the tuple of
+        positions one legal move away (staying put is not a move).
+        """
+        table = {}
+        for position, actions in moveTable.items():
+            table[position] = tuple([Actions.getSuccessor(position, action) for action in actions if action != Directions.STOP])
+        return table
+    buildNeighborTable = staticmethod(buildNeighborTable)
+
     def getLegalNeighbors(position, walls):
         x,y = position
         x_int, y_int = int(x + 0.5), int(y + 0.5)
@@ -368,18 +559,60 @@ class Actions:
         return (x + dx, y + dy)
     getSuccessor = staticmethod(getSuccessor)
 
+ZOBRIST_KEYS = {}
+# Keys come from their own generator so hashing never shifts the game's random stream
+ZOBRIST_RANDOM = random.Random(1048575)
+
+def zobristKey(feature):
+    """
+    Returns the random 64-bit key of a hashable state feature such as
+    ('food', x, y), drawing it the first time the feature is seen.  A state's
+    Zobrist hash is the XOR of the keys of all its features.
+    """
+    try:
+        return ZOBRIST_KEYS[feature]
+    except KeyError:
+        key = ZOBRIST_RANDOM.getrandbits(64)
+        ZOBRIST_KEYS[feature] = key
+        return key
+
 class GameStateData:
     """
+    The game data shared by pacman.py and capture.py states.
+
+    The data keeps a 64-bit Zobrist hash up to date as rules change it: setFood
+    and removeCapsule update the food and capsule parts, and
+    getMutableAgentState marks an agent's key for recomputation.  Food,
+    capsules and agents must therefore only be changed through those methods.
 
+    Capture games also keep per-team views (see initializeTeamViews), which
+    setFood and removeCapsule update in the same way.
     """
     def __init__( self, prevState = None ):
         """
-        Generates a new data packet by copying information from its predecessor.
+        Generates a new data packet from its predecessor.
+
+        The new packet shares the food grid, the capsule list and every
+        AgentState with prevState.  Rules that change them must go through
+        getMutableAgentState, setFood and removeCapsule, which copy the shared
+        object the first time it is written.
         """
         if prevState != None:
-            self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            self.food = prevState.food
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
+            self._ownedAgents = [False for a in self.agentStates]
+            self._agentHashes = prevState._agentHashes[:]
+            self._foodHash = prevState._foodHash
+            self._capsuleHash = prevState._capsuleHash
+            self.redFood = prevState.redFood
+            self.blueFood = prevState.blueFood
+            self.redFoodCount = prevState.redFoodCount
+            self.blueFoodCount = prevState.blueFoodCount
+            self.redCapsules = prevState.redCapsules
+            self.blueCapsules = prevState.blueCapsules
+            self.redReturned = prevState.redReturned
+            self.blueReturned = prevState.blueReturned
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
@@ -395,7 +628,15 @@ class GameStateData:
     def deepCopy( self ):
         state = GameStateData( self )
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.capsules = self.capsules[:]
+        if self.redFood is not None:
+            state.redFood = self.redFood.copy()
+            state.blueFood = self.blueFood.copy()
+            state.redCapsules = self.redCapsules[:]
+            state.blueCapsules = self.blueCapsules[:]
+        state.agentStates = self.copyAgentStates( self.agentStates )
+        state._ownedAgents = [True for a in state.agentStates]
+        state._agentHashes = self._agentHashes[:]
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
@@ -408,33 +649,152 @@ class GameStateData:
             copiedStates.append( agentState.copy() )
         return copiedStates
 
+    def getMutableAgentState( self, index ):
+        """
+        Returns the AgentState of agent index, copying it first if it is still
+        shared with the state this packet was generated from.
+        """
+        if not self._ownedAgents[index]:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgents[index] = True
+        # The caller is about to change the agent, so its key is stale
+        self._agentHashes[index] = None
+        return self.agentStates[index]
+
+    def setFood( self, x, y, value ):
+        "Sets food at (x,y) without touching the grid shared with other states"
+        # Bit writes, since a new grid would otherwise unpack its columns first
+        index = self.food.cellIndex(x, y)
+        if self.food.getBit(index) == bool(value): return
+        food = self.food.copy()
+        food.setBit(index, value)
+        self.food = food
+        if self._foodHash is not None:
+            self._foodHash ^= zobristKey(('food', x, y))
+        if self.redFood is not None:
+            change = 1 if value else -1
+            if x < self.layout.width / 2:
+                food = self.redFood.copy()
+                food.setBit(index, value)
+                self.redFood = food
+                self.redFoodCount += change
+            else:
+                food = self.blueFood.copy()
+                food.setBit(index, value)
+                self.blueFood = food
+                self.blueFoodCount += change
+
+    def removeCapsule( self, position ):
+        "Removes a capsule without touching the list shared with other states"
+        capsules = self.capsules[:]
+        capsules.remove( position )
+        self.capsules = capsules
+        if self._capsuleHash is not None:
+            self._capsuleHash ^= zobristKey(('capsule', position))
+        if self.redCapsules is not None:
+            if position in self.redCapsules:
+                capsules = self.redCapsules[:]
+                capsules.remove( position )
+                self.redCapsules = capsules
+            else:
+                capsules = self.blueCapsules[:]
+                capsules.remove( position )
+                self.blueCapsules = capsules
+
+    def initializeTeamViews( self ):
+        """
+        Splits the food and capsules between the red (left) and blue (right)
+        halves of the board, and starts the returned-food totals at zero.
+
+        After this, setFood and removeCapsule keep redFood, blueFood, their
+        counts and redCapsules and blueCapsules up to date, and the capture
+        rules add to redReturned and blueReturned as food is brought home.
+        Like food and capsules, the views are shared between states and
+        must not be modified in place.  A capsule in the middle column
+        counts as red, as it always has.
+        """
+        layout = self.layout
+        self.redFood = self.food & layout.redHalf
+        self.blueFood = self.food & layout.blueHalf
+        self.redFoodCount = self.redFood.count()
+        self.blueFoodCount = self.blueFood.count()
+        halfway = layout.width / 2
+        self.redCapsules = [(x, y) for x, y in self.capsules if x <= halfway]
+        self.blueCapsules = [(x, y) for x, y in self.capsules if x > halfway]
+        self.redReturned = 0
+        self.blueReturned = 0
+
+    def __getstate__( self ):
+        "Pickles the data without its cached hashes, since Zobrist keys are drawn per process"
+        state = self.__dict__.copy()
+        state['_agentHashes'] = [None for a in self.agentStates]
+        state['_foodHash'] = None
+        state['_capsuleHash'] = None
+        return state
+
+    def _resetHashes( self ):
+        self._agentHashes = [None for a in self.agentStates]
+        self._foodHash = None
+        self._capsuleHash = None
+
+    def _agentHash( self, index ):
+        # Matches AgentState.__eq__, which only looks at configuration and scaredTimer
+        agentState = self.agentStates[index]
+        configuration = agentState.configuration
+        if configuration is None:
+            key = zobristKey(('agent', index, None, None))
+        else:
+            key = zobristKey(('agent', index, configuration.pos, configuration.direction))
+        return key ^ zobristKey(('scared', index, agentState.scaredTimer))
+
+    def getZobristHash( self ):
+        """
+        Returns the 64-bit Zobrist hash of the food, capsules, agents and score.
+        Only the parts that changed since the predecessor state are recomputed.
+        """
+        if self._foodHash is None:
+            self._foodHash = 0
+            for x, y in self.food.asList():
+                self._foodHash ^= zobristKey(('food', x, y))
+        if self._capsuleHash is None:
+            self._capsuleHash = 0
+            for position in self.capsules:
+                self._capsuleHash ^= zobristKey(('capsule', position))
+        h = self._foodHash ^ self._capsuleHash ^ zobristKey(('score', self.score))
+        agentHashes = self._agentHashes
+        for index in range(len(agentHashes)):
+            if agentHashes[index] is None:
+                agentHashes[index] = self._agentHash(index)
+            h ^= agentHashes[index]
+        return h
+
     def __eq__( self, other ):
         """
         Allows two states to be compared.
         """
-        if other == None: return False
-        # TODO Check for type of other
-        if not self.agentStates == other.agentStates: return False
-        if not self.food == other.food: return False
-        if not self.capsules == other.capsules: return False
+        if not isinstance(other, GameStateData): return False
+        if self.getZobristHash() != other.getZobristHash(): return False
+        # Equal hashes: confirm, skipping the objects the two states share
         if not self.score == other.score: return False
-        return True
+        if not (self.food is other.food or self.food == other.food): return False
+        if not (self.capsules is other.capsules or self.capsules == other.capsules): return False
+        for mine, theirs in zip(self.agentStates, other.agentStates):
+            if not (mine is theirs or mine == theirs): return False
+        return len(self.agentStates) == len(other.agentStates)
+
+    def __ne__( self, other ):
+        return not self == other
 
     def __hash__( self ):
         """
         Allows states to be keys of dictionaries.
         """
-        for i, state in enumerate( self.agentStates ):
-            try:
-                int(hash(state))
-            except TypeError, e:
-                print e
-                #hash(state)
-        return int((hash(tuple(self.agentStates)) + 13*hash(self.food) + 113* hash(tuple(self.capsules)) + 7 * hash(self.score)) % 1048575 )
+        return self.getZobristHash()
 
     def __str__( self ):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
+        # Grids only hold booleans, so the characters go in a list of columns
+        map = [[' ' for y in range(height)] for x in range(width)]
         if type(self.food) == type((1,2)):
             self.food = reconstituteGrid(self.food)
         for x in range(width):
@@ -455,7 +815,9 @@ class GameStateData:
         for x, y in self.capsules:
             map[x][y] = 'o'
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        rows = [''.join([map[x][y] for x in range(width)]) for y in range(height)]
+        rows.reverse()
+        return '\n'.join(rows) + ("\nScore: %d\n" % self.score)
 
     def _foodWallStr( self, hasFood, hasWall ):
         if hasFood:
@@ -502,7 +864,13 @@ class GameStateData:
                 if numGhosts == numGhostAgents: continue # Max ghosts reached already
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
+        self._ownedAgents = [True for a in self.agentStates]
+        self._resetHashes()
         self._eaten = [False for a in self.agentStates]
+        self.redFood = self.blueFood = None
+        self.redFoodCount = self.blueFoodCount = 0
+        self.redCapsules = self.blueCapsules = None
+        self.redReturned = self.blueReturned = 0
 
 try:
     import boinc
@@ -510,12 +878,29 @@ try:
 except:
     _BOINC_ENABLED = False
 
+# Seconds a startup thread may run past its agents' budgets before it is given up
+STARTUP_GRACE = 1.0
+
 class Game:
     """
     The Game manages the control flow, soliciting actions from agents.
+
+    A turbo game is meant for headless play: it never calls the display.
+
+    With parallelStartup (and catchExceptions) the agents' registerInitialState
+    calls run at the same time, each against its own startup budget.  This
+    only applies when every agent runs in a process of its own and says so
+    with a startupGroup attribute, as the proxies of agentSandbox do:
+    in-process agents would share one interpreter lock and be charged for
+    each other's time, so they are set up one after another as usual.  Each
+    startupGroup (the two agents of a sandboxed team) gets a thread and
+    its agents take turns in it.  The threads' draws from the shared random
+    module interleave in no fixed order, so the startup is not reproducible
+    under a fixed seed; the game's random state is reseeded afterwards so
+    that the play itself still is.
     """
 
-    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
+    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False, turbo=False, parallelStartup=False ):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -524,6 +909,8 @@ class Game:
         self.gameOver = False
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
+        self.turbo = turbo
+        self.parallelStartup = parallelStartup
         self.moveHistory = []
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
@@ -550,7 +937,6 @@ class Game:
     def mute(self, agentIndex):
         if not self.muteAgents: return
         global OLD_STDOUT, OLD_STDERR
-        import cStringIO
         OLD_STDOUT = sys.stdout
         OLD_STDERR = sys.stderr
         sys.stdout = self.agentOutput[agentIndex]
@@ -564,15 +950,94 @@ class Game:
         sys.stderr = OLD_STDERR
 
 
+    def _registerInParallel( self ):
+        """
+        Runs the agents' registerInitialState calls in threads (see the class
+        docstring) and returns whether they all succeeded.  Otherwise the
+        failure of the lowest-numbered agent ends the game, as it would have
+        in a sequential startup.  A thread still running once its agents'
+        budgets are spent, such as one stuck in a long C call, is left behind
+        as a daemon and its agent timed out.
+        """
+        agents = self.agents
+        lanes, groups = [], {}
+        for i in range(len(agents)):
+            if not hasattr(agents[i], 'registerInitialState'): continue
+            group = agents[i].startupGroup
+            if id(group) in groups:
+                groups[id(group)].append(i)
+            else:
+                groups[id(group)] = [i]
+                lanes.append(groups[id(group)])
+        # None until an agent's call ends, then 'done', 'timeout' or 'crash'
+        outcomes = [None for agent in agents]
+        states = [self.state.deepCopy() for agent in agents]
+        # The output of each startup thread, by thread id, while agents are muted
+        streams = {}
+
+        def register(lane):
+            for i in lane:
+                if self.muteAgents: streams[thread.get_ident()] = self.agentOutput[i]
+                timed_func = TimeoutFunction(agents[i].registerInitialState, self.rules.getMaxStartupTime(i))
+                try:
+                    timed_func(states[i])
+                except TimeoutFunctionException:
+                    print >>sys.stderr, "Agent %d ran out of time on startup!" % i
+                    outcomes[i] = 'timeout'
+                    return
+                except:
+                    traceback.print_exc()
+                    outcomes[i] = 'crash'
+                    return
+                self.totalAgentTimes[i] += timed_func.elapsed
+                outcomes[i] = 'done'
+
+        threads = []
+        for lane in lanes:
+            t = threading.Thread(target=register, args=(lane,), name='Startup %s' % lane)
+            t.daemon = True
+            threads.append((t, lane, time.time() + sum([self.rules.getMaxStartupTime(i) for i in lane])))
+        # Drawn before the threads run, to reseed the game once they are done
+        seed = random.random()
+        stdout, stderr = sys.stdout, sys.stderr
+        if self.muteAgents:
+            sys.stdout, sys.stderr = ThreadOutput(stdout, streams), ThreadOutput(stderr, streams)
+        try:
+            for t, lane, expiry in threads:
+                t.start()
+            for t, lane, expiry in threads:
+                # A deadline fires between bytecodes, so allow it a moment past the budget
+                t.join(max(expiry - time.time(), 0) + STARTUP_GRACE)
+                pending = [i for i in lane if outcomes[i] is None]
+                if t.is_alive() and pending:
+                    outcomes[pending[0]] = 'timeout'
+                    output = self.muteAgents and self.agentOutput[pending[0]] or stderr
+                    print >>output, "Agent %d ran out of time on startup!" % pending[0]
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        random.seed(seed)
+        for i in range(len(agents)):
+            if outcomes[i] == 'timeout':
+                self.agentTimeout = True
+            if outcomes[i] in ('timeout', 'crash'):
+                self._agentCrash(i, quiet=True)
+                return False
+        return True
+
     def run( self ):
         """
         Main control loop for game play.
         """
-        self.display.initialize(self.state.data)
+        turbo = self.turbo
+        if not turbo: self.display.initialize(self.state.data)
         self.numMoves = 0
+        # Agent hooks are looked up once per game rather than every turn
+        observationFunctions = [getattr(agent, 'observationFunction', None) for agent in self.agents]
 
         ###self.display.initialize(self.state.makeObservation(1).data)
         # inform learning agents of the game start
+        parallelStartup = self.parallelStartup and self.catchExceptions and \
+                          None not in [getattr(agent, 'startupGroup', None) for agent in self.agents]
         for i in range(len(self.agents)):
             agent = self.agents[i]
             if not agent:
@@ -583,16 +1048,14 @@ class Game:
                 self.unmute()
                 self._agentCrash(i, quiet=True)
                 return
-            if ("registerInitialState" in dir(agent)):
+            if hasattr(agent, 'registerInitialState') and not parallelStartup:
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
+                        timed_func = TimeoutFunction(agent.registerInitialState, self.rules.getMaxStartupTime(i))
                         try:
-                            start_time = time.time()
                             timed_func(self.state.deepCopy())
-                            time_taken = time.time() - start_time
-                            self.totalAgentTimes[i] += time_taken
+                            self.totalAgentTimes[i] += timed_func.elapsed
                         except TimeoutFunctionException:
                             print >>sys.stderr, "Agent %d ran out of time on startup!" % i
                             self.unmute()
@@ -607,9 +1070,13 @@ class Game:
                     agent.registerInitialState(self.state.deepCopy())
                 ## TODO: could this exceed the total time
                 self.unmute()
+        if parallelStartup and not self._registerInParallel():
+            return
 
         agentIndex = self.startingIndex
         numAgents = len( self.agents )
+        # Unmuted games skip the redirection calls around every move
+        muting = self.muteAgents
 
         while not self.gameOver:
             # Fetch the next agent
@@ -617,36 +1084,37 @@ class Game:
             move_time = 0
             skip_action = False
             # Generate an observation of the state
-            if 'observationFunction' in dir( agent ):
-                self.mute(agentIndex)
+            observationFunction = observationFunctions[agentIndex]
+            if observationFunction is not None:
+                if muting: self.mute(agentIndex)
+                # A copy, so that an observer cannot change the game's state
+                observed = self.state.deepCopy()
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
+                        timed_func = TimeoutFunction(observationFunction, self.rules.getMoveTimeout(agentIndex))
                         try:
-                            start_time = time.time()
-                            observation = timed_func(self.state.deepCopy())
+                            observation = timed_func(observed)
                         except TimeoutFunctionException:
                             skip_action = True
-                        move_time += time.time() - start_time
-                        self.unmute()
+                        move_time += timed_func.elapsed
                     except Exception,data:
                         self._agentCrash(agentIndex, quiet=False)
                         self.unmute()
                         return
                 else:
-                    observation = agent.observationFunction(self.state.deepCopy())
-                self.unmute()
+                    observation = observationFunction(observed)
+                if muting: self.unmute()
             else:
                 observation = self.state.deepCopy()
 
             # Solicit an action
             action = None
-            self.mute(agentIndex)
+            if muting: self.mute(agentIndex)
             if self.catchExceptions:
                 try:
-                    timed_func = TimeoutFunction(agent.getAction, int(self.rules.getMoveTimeout(agentIndex)) - int(move_time))
+                    # The observation's time counts against the move's budget
+                    timed_func = TimeoutFunction(agent.getAction, self.rules.getMoveTimeout(agentIndex) - move_time)
                     try:
-                        start_time = time.time()
                         if skip_action:
                             raise TimeoutFunctionException()
                         action = timed_func( observation )
@@ -657,7 +1125,7 @@ class Game:
                         self.unmute()
                         return
 
-                    move_time += time.time() - start_time
+                    move_time += timed_func.elapsed
 
                     if move_time > self.rules.getMoveWarningTime(agentIndex):
                         self.totalAgentTimeWarnings[agentIndex] += 1
@@ -677,14 +1145,13 @@ class Game:
                         self._agentCrash(agentIndex, quiet=True)
                         self.unmute()
                         return
-                    self.unmute()
                 except Exception,data:
                     self._agentCrash(agentIndex)
                     self.unmute()
                     return
             else:
                 action = agent.getAction(observation)
-            self.unmute()
+            if muting: self.unmute()
 
             # Execute the action
             self.moveHistory.append( (agentIndex, action) )
@@ -700,7 +1167,7 @@ class Game:
                 self.state = self.state.generateSuccessor( agentIndex, action )
 
             # Change the display
-            self.display.update( self.state.data )
+            if not turbo: self.display.update( self.state.data )
             ###idx = agentIndex - agentIndex % 2 + 1
             ###self.display.update( self.state.makeObservation(idx).data )
 
@@ -716,7 +1183,7 @@ class Game:
 
         # inform a learning agent of the game result
         for agentIndex, agent in enumerate(self.agents):
-            if "final" in dir( agent ) :
+            if hasattr(agent, 'final'):
                 try:
                     self.mute(agentIndex)
                     agent.final( self.state )
@@ -726,4 +1193,4 @@ class Game:
                     self._agentCrash(agentIndex)
                     self.unmute()
                     return
-        self.display.finish()
+        if not turbo: self.display.finish()
@@ -14,14 +14,22 @@
 
 from util import manhattanDistance
 from game import Grid
+from game import Actions
 import os
 import random
+import hashlib
 
 VISIBILITY_MATRIX_CACHE = {}
+LAYOUT_CACHE = {}
 
 class Layout:
     """
     A Layout manages the static information about the game board.
+
+    A Layout is frozen once it has been built: game states share it by
+    reference, so its attributes (and the grids and lists they hold) must not
+    be changed.  Layouts built through internLayout, getLayout or tryToLoad are
+    also shared between games that use the same map, keyed by fingerprint.
     """
 
     def __init__(self, layoutText):
@@ -34,8 +42,110 @@ class Layout:
         self.numGhosts = 0
         self.processLayoutText(layoutText)
         self.layoutText = layoutText
-        self.totalFood = len(self.food.asList())
+        self.fingerprint = layoutFingerprint(layoutText)
+        self.wallFingerprint = wallFingerprint(self.walls)
+        self.totalFood = self.food.count()
+        self.processTeamHalves()
+        self.moveTable = Actions.buildMoveTable(self.walls)
+        self.neighborTable = Actions.buildNeighborTable(self.moveTable)
+        self.processCellIds()
+        self.isSymmetric = self.walls == self.walls.pointReflection()
         # self.initializeVisibilityMatrix()
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen'):
+            raise AttributeError('Layouts are immutable; cannot set ' + name)
+        self.__dict__[name] = value
+
+    def processTeamHalves(self):
+        """
+        Precomputes the open cells, the cells on each team's half (as masks
+        for Grid &) and each team's boundary column, the last column on its
+        own side.
+        """
+        halfway = self.width / 2
+        self.legalPositions = self.walls.asList(False)
+        board = Grid(self.width, self.height, True)
+        self.redHalf = board.maskColumns(0, halfway)
+        self.blueHalf = board.maskColumns(halfway, self.width)
+        self.redBoundary = [(halfway - 1, y) for y in range(self.height) if not self.walls[halfway - 1][y]]
+        self.blueBoundary = [(halfway, y) for y in range(self.height) if not self.walls[halfway][y]]
+
+    def processCellIds(self):
+        """
+        Numbers the open cells 0..n-1 in the order of legalPositions, so that
+        per-cell data can live in flat lists indexed by cell id:
+
+          cells          cell id -> (x,y)
+          cellIds        (x,y) -> cell id
+          cellBits       cell id -> Grid bit index (see Grid.cellIndex)
+          bitCells       Grid bit index -> cell id, or -1 for walls
+          moveTableById  cell id -> legal actions, as in moveTable
+          neighborIds    cell id -> ids of the cells one move away
+        """
+        self.cells = tuple(self.legalPositions)
+        self.cellIds = dict([(pos, i) for i, pos in enumerate(self.cells)])
+        self.cellBits = [self.walls.cellIndex(x, y) for x, y in self.cells]
+        bitCells = [-1] * (self.width * self.height)
+        for cellId, bit in enumerate(self.cellBits):
+            bitCells[bit] = cellId
+        self.bitCells = bitCells
+        self.moveTableById = [self.moveTable[pos] for pos in self.cells]
+        self.neighborIds = [tuple([self.cellIds[n] for n in self.neighborTable[pos]]) for pos in self.cells]
+
+    def getNumCells(self):
+        return len(self.cells)
+
+    def getMirrorPosition(self, pos):
+        "Returns the position opposite pos through the centre of the board"
+        x, y = pos
+        return (self.width - 1 - x, self.height - 1 - y)
+
+    def getMirrorCellId(self, cellId):
+        """
+        Returns the cell id of the mirror of cell cellId, or None if it is a
+        wall.  On a point-symmetric board (isSymmetric, which most capture
+        boards are) cell ids run through the two halves in opposite orders,
+        so the mirror of cell i is cell n-1-i.
+        """
+        if self.isSymmetric:
+            return len(self.cells) - 1 - cellId
+        return self.cellIds.get(self.getMirrorPosition(self.cells[cellId]))
+
+    def getCanonicalPosition(self, pos, isRed):
+        """
+        Returns pos as the red team would see it: unchanged for red, and
+        mirrored for blue.  On a symmetric board both teams can then share
+        tables keyed by position.
+        """
+        if isRed: return pos
+        return self.getMirrorPosition(pos)
+
+    def getCellId(self, pos):
+        """
+        Returns the cell id of a grid position, or None for walls and for
+        positions between cells.
+        """
+        return self.cellIds.get(pos)
+
+    def getCellPosition(self, cellId):
+        return self.cells[cellId]
+
+    def getCellIds(self, grid):
+        "Returns the ids of the open cells set in grid, in cell id order"
+        bitCells = self.bitCells
+        return [bitCells[i] for i in grid.bitIndices() if bitCells[i] >= 0]
+
+    def getCellGrid(self, cellIds):
+        "Returns a Grid with exactly the given cells set"
+        grid = Grid(self.width, self.height)
+        cellBits = self.cellBits
+        bits = 0
+        for cellId in cellIds:
+            bits |= 1 << cellBits[cellId]
+        grid.bits = bits
+        return grid
 
     def getNumGhosts(self):
         return self.numGhosts
@@ -56,10 +166,10 @@ class Layout:
                             while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)] :
                                 vis[x][y][direction].add((nextx, nexty))
                                 nextx, nexty = x + dx, y + dy
-            self.visibility = vis
+            self.__dict__['visibility'] = vis
             VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
         else:
-            self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
+            self.__dict__['visibility'] = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
 
     def isWall(self, pos):
         x, col = pos
@@ -90,7 +200,8 @@ class Layout:
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        # Layouts are immutable, so every copy can be the layout itself
+        return self
 
     def processLayoutText(self, layoutText):
         """
@@ -128,6 +239,27 @@ class Layout:
         elif layoutChar in  ['1', '2', '3', '4']:
             self.agentPositions.append( (int(layoutChar), (x,y)))
             self.numGhosts += 1
+def layoutFingerprint(layoutText):
+    "Returns a content hash identifying the map described by layoutText"
+    return hashlib.sha1('\n'.join(layoutText)).hexdigest()
+
+def wallFingerprint(walls):
+    """
+    Returns a hash identifying a wall grid.  Maze distances and cell ids only
+    depend on the walls, so layouts that differ only in food share it.
+    """
+    return hashlib.sha1('%d %d %x' % (walls.width, walls.height, walls.bits)).hexdigest()
+
+def internLayout(layoutText):
+    """
+    Returns the shared Layout for layoutText, parsing it only the first time
+    a map with this content is seen.
+    """
+    fingerprint = layoutFingerprint(layoutText)
+    if fingerprint not in LAYOUT_CACHE:
+        LAYOUT_CACHE[fingerprint] = Layout(layoutText)
+    return LAYOUT_CACHE[fingerprint]
+
 def getLayout(name, back = 2):
     if name.endswith('.lay'):
         layout = tryToLoad('layouts/' + name)
@@ -145,5 +277,5 @@ def getLayout(name, back = 2):
 def tryToLoad(fullname):
     if(not os.path.exists(fullname)): return None
     f = open(fullname)
-    try: return Layout([line.strip() for line in f])
+    try: return internLayout([line.strip() for line in f])
     finally: f.close()
@@ -13,6 +13,7 @@
 
 
 import random, sys
+import layout
 
 """
 maze generator code
@@ -53,6 +54,7 @@ class Maze:
     self.rooms = []
     self.root = root
     if not self.root: self.root = self
+    self.wall_cells = []
 
   def to_map(self):
     """
@@ -74,6 +76,26 @@ class Maze:
     self.grid.append([W for c in range(self.c)])
     self.r += 2
 
+  def get_rooms(self):
+    """
+    returns the room hierarchy below this (unmapped) maze as a list of
+    (parent index, (top row, left col, bottom row, right col)), parents first;
+    the maze itself is entry 0 with parent -1
+    """
+    rooms = []
+    todo = [(-1, self)]
+    while todo:
+      parent, room = todo.pop(0)
+      row, col = room.anchor
+      rooms.append((parent, (row, col, row+room.r-1, col+room.c-1)))
+      todo.extend([(len(rooms)-1, sub_room) for sub_room in room.rooms])
+    return rooms
+
+  def get_gaps(self):
+    "returns the (row, col) cells of the walls built so far that were left open"
+    gaps = set([cell for cell in self.root.wall_cells if self.root.grid[cell[0]][cell[1]] == E])
+    return sorted(gaps)
+
   def __str__(self):
     s = ''
     for row in range(self.r):
@@ -99,6 +121,7 @@ class Maze:
       random.shuffle(slots)
       for row in slots[int(round(gaps)):]:
         self.root.grid[row][add_c+i] = W
+      self.root.wall_cells.extend([(add_r+x, add_c+i) for x in range(self.r)])
       self.rooms.append(Maze(self.r, i, (add_r,add_c), self.root))
       self.rooms.append(Maze(self.r, self.c-i-1, (add_r,add_c+i+1), self.root))
     else:
@@ -113,6 +136,7 @@ class Maze:
       random.shuffle(slots)
       for col in slots[int(round(gaps)):]:
         self.root.grid[add_r+i][col] = W
+      self.root.wall_cells.extend([(add_r+i, add_c+x) for x in range(self.c)])
       self.rooms.append(Maze(i, self.c, (add_r,add_c), self.root))
       self.rooms.append(Maze(self.r-i-1, self.c, (add_r+i+1,add_c), self.root))
 
@@ -140,6 +164,7 @@ def make_with_prison(room, depth, gaps=1, vert=True, min_width=1, gapfactor=0.5)
     cur_col = 2*(j+1)-1
     for row in range(room.r):
       room.root.grid[row][cur_col] = W
+    room.root.wall_cells.extend([(row, cur_col) for row in range(room.r)])
     if j % 2 == 0:
       room.root.grid[0][cur_col] = E
     else:
@@ -253,16 +278,73 @@ def add_pacman_stuff(maze, max_food=60, max_capsules=4, toskip=0):
 
 MAX_DIFFERENT_MAZES = 10000
 
+# Room structures of recently generated mazes, keyed by layout fingerprint.
+# Like capture.SuccessorCache they live in two generations of at most
+# MAX_MAZE_STRUCTURES / 2 each, so that long runs on random mazes only keep
+# the ones generated or asked for lately.
+MAX_MAZE_STRUCTURES = 64
+MAZE_STRUCTURES = {'recent': {}, 'older': {}}
+
+def _keepMazeStructure(fingerprint, structure):
+  if len(MAZE_STRUCTURES['recent']) >= MAX_MAZE_STRUCTURES / 2:
+    MAZE_STRUCTURES['older'] = MAZE_STRUCTURES['recent']
+    MAZE_STRUCTURES['recent'] = {}
+  MAZE_STRUCTURES['recent'][fingerprint] = structure
+
 def generateMaze(seed = None):
-  if not seed:
+  return generateMazeStructure(seed)[0]
+
+def generateMazeStructure(seed = None):
+  """
+  Generates a maze and returns (layout text, rooms, gaps), where rooms and
+  gaps are in layout (x, y) coordinates and cover both mirrored halves:
+
+    rooms   a list of (parent index, (xMin, yMin, xMax, yMax)), parents
+            first; each half's whole board is a room with parent -1
+    gaps    the open cells of the walls that split rooms
+
+  The structure is also kept for getMazeStructure, for a while.
+  """
+  if seed is None:
     seed = random.randint(1,MAX_DIFFERENT_MAZES)
   random.seed(seed)
   maze = Maze(16,16)
   gapfactor = min(0.65,random.gauss(0.5,0.1))
   skip = make_with_prison(maze, depth=0, gaps=3, vert=True, min_width=1, gapfactor=gapfactor)
+  rows, cols = maze.r, maze.c
+  rooms = maze.get_rooms()
+  gaps = maze.get_gaps()
   maze.to_map()
   add_pacman_stuff(maze, 2*(maze.r*maze.c/20), 4, skip)
-  return str(maze)
+  text = str(maze)
+
+  # to_map adds a border and a copy turned half way round; layouts count y up
+  def left(row, col): return (col+1, rows-row)
+  def right(row, col): return (2*cols-col, row+1)
+  structure = []
+  for toLayout in [left, right]:
+    offset = len(structure)
+    for parent, (top, leftCol, bottom, rightCol) in rooms:
+      if parent >= 0: parent += offset
+      x1, y1 = toLayout(top, leftCol)
+      x2, y2 = toLayout(bottom, rightCol)
+      structure.append((parent, (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))))
+  gapCells = [left(row, col) for row, col in gaps] + [right(row, col) for row, col in gaps]
+
+  _keepMazeStructure(layout.layoutFingerprint(text.split('\n')), (structure, gapCells))
+  return text, structure, gapCells
+
+def getMazeStructure(mazeLayout):
+  """
+  Returns (rooms, gaps) as from generateMazeStructure for a layout this
+  process generated recently, or None for any other layout.
+  """
+  fingerprint = mazeLayout.fingerprint
+  structure = MAZE_STRUCTURES['recent'].get(fingerprint)
+  if structure is None:
+    structure = MAZE_STRUCTURES['older'].pop(fingerprint, None)
+    if structure is not None: _keepMazeStructure(fingerprint, structure)
+  return structure
 
 if __name__ == '__main__':
   seed = None
@@ -0,0 +1,659 @@
+# mazeGraph.py
+# ------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+This file contains a CorridorGraph, which contracts the corridors of a
+maze into weighted edges between junctions, so that searches only branch
+where there is a choice to make.
+
+Example:
+graph = getCorridorGraph(gameState.data.layout)
+graph.getDistance( (1,1), (10,10) )
+graph.getPath( (1,1), (10,10) )
+"""
+
+import heapq
+
+corridorGraphMap = {}
+
+def getCorridorGraph(layout):
+  "Returns the CorridorGraph of layout, building it the first time its walls are seen"
+  if layout.wallFingerprint not in corridorGraphMap:
+    corridorGraphMap[layout.wallFingerprint] = CorridorGraph(layout)
+  return corridorGraphMap[layout.wallFingerprint]
+
+class CorridorGraph:
+  """
+  The maze as a graph whose nodes are junctions: cells with other than two
+  open neighbours (dead ends, forks and crossings).  Every run of two-way
+  cells between junctions becomes one edge weighted by its length.  A loop
+  with no junction on it gets one of its cells as a junction.
+
+  Cells are layout cell ids (see Layout.getCellId) and are mapped to the
+  reduced graph by:
+
+    nodeIds       cell id -> node id, or -1 for corridor cells
+    nodeCells     node id -> cell id
+    edgeOf        cell id -> (edge id, offset) for corridor cells, where
+                  offset is the number of moves from the edge's first node
+    edges         edge id -> (first node, last node, length, corridor cells)
+    adjacency     node id -> list of (other node, length, edge id)
+
+  Edges run from the first node through the corridor cells, in order, to the
+  last node; a dead-end spur or a loop can start and end at the same node.
+  """
+  def __init__(self, layout):
+    self.layout = layout
+    neighborIds = layout.neighborIds
+    numCells = layout.getNumCells()
+    self.nodeIds = [-1] * numCells
+    self.nodeCells = []
+    for cell in range(numCells):
+      if len(neighborIds[cell]) != 2:
+        self.addNode(cell)
+    self.edgeOf = [None] * numCells
+    self.edges = []
+    self.adjacency = [[] for node in self.nodeCells]
+    for node in range(len(self.nodeCells)):
+      self.traceEdges(node)
+    # Whatever is left lies on loops without a junction
+    for cell in range(numCells):
+      if self.nodeIds[cell] < 0 and self.edgeOf[cell] is None:
+        node = self.addNode(cell)
+        self.adjacency.append([])
+        self.traceEdges(node)
+
+  def addNode(self, cell):
+    self.nodeIds[cell] = len(self.nodeCells)
+    self.nodeCells.append(cell)
+    return self.nodeIds[cell]
+
+  def traceEdges(self, node):
+    "Follows each corridor leaving node that has not been traced yet"
+    neighborIds = self.layout.neighborIds
+    start = self.nodeCells[node]
+    for first in neighborIds[start]:
+      if self.nodeIds[first] < 0 and self.edgeOf[first] is not None: continue
+      if self.nodeIds[first] >= 0 and self.hasEdge(node, self.nodeIds[first], 1): continue
+      corridor = []
+      previous, cell = start, first
+      while self.nodeIds[cell] < 0:
+        corridor.append(cell)
+        nextCell = neighborIds[cell][0]
+        if nextCell == previous: nextCell = neighborIds[cell][1]
+        previous, cell = cell, nextCell
+      self.addEdge(node, self.nodeIds[cell], corridor)
+
+  def hasEdge(self, node, other, length):
+    for neighbor, edgeLength, edge in self.adjacency[node]:
+      if neighbor == other and edgeLength == length: return True
+    return False
+
+  def addEdge(self, first, last, corridor):
+    edge = len(self.edges)
+    length = len(corridor) + 1
+    self.edges.append((first, last, length, tuple(corridor)))
+    for offset, cell in enumerate(corridor):
+      self.edgeOf[cell] = (edge, offset + 1)
+    self.adjacency[first].append((last, length, edge))
+    if last != first:
+      self.adjacency[last].append((first, length, edge))
+
+  def getNumNodes(self):
+    return len(self.nodeCells)
+
+  def getNumEdges(self):
+    return len(self.edges)
+
+  def isJunction(self, pos):
+    return self.nodeIds[self.getCellId(pos)] >= 0
+
+  def getJunctionNeighbors(self, pos):
+    """
+    Returns a list of (junction position, distance) for the junctions one
+    corridor away from the junction at pos.
+    """
+    node = self.nodeIds[self.getCellId(pos)]
+    if node < 0: raise Exception("Not a junction: " + str(pos))
+    cells = self.layout.cells
+    return [(cells[self.nodeCells[other]], length) for other, length, edge in self.adjacency[node]]
+
+  def getCellId(self, pos):
+    cell = self.layout.getCellId(pos)
+    if cell is None: raise Exception("Position not in grid: " + str(pos))
+    return cell
+
+  def getExits(self, cell):
+    """
+    Returns a list of (node, distance, edge) for the ways onto the reduced
+    graph from cell: itself if it is a junction, otherwise the two ends of
+    its corridor.
+    """
+    node = self.nodeIds[cell]
+    if node >= 0: return [(node, 0, None)]
+    edge, offset = self.edgeOf[cell]
+    first, last, length, corridor = self.edges[edge]
+    return [(first, offset, edge), (last, length - offset, edge)]
+
+  def search(self, cell1, cell2):
+    """
+    Runs Dijkstra over the junctions from cell1 to cell2.  Returns the
+    distance (None if cell2 cannot be reached), the last junction on the
+    way (None if the path stays in one corridor) and the chain of
+    (junction, edge taken to reach it) steps leading there.
+    """
+    if cell1 == cell2: return 0, None, []
+    best = None
+    bestRoute = None
+    # Two cells on the same corridor can also meet without leaving it
+    if self.nodeIds[cell1] < 0 and self.nodeIds[cell2] < 0:
+      edge1, offset1 = self.edgeOf[cell1]
+      edge2, offset2 = self.edgeOf[cell2]
+      if edge1 == edge2:
+        best = abs(offset1 - offset2)
+    targets = {}
+    for node, distance, edge in self.getExits(cell2):
+      if node not in targets or distance < targets[node][0]:
+        targets[node] = (distance, edge)
+    distances = {}
+    parents = {}
+    fringe = []
+    for node, distance, edge in self.getExits(cell1):
+      fringe.append((distance, node, None, edge))
+    heapq.heapify(fringe)
+    while fringe:
+      distance, node, parent, edge = heapq.heappop(fringe)
+      if best is not None and distance >= best: break
+      if node in distances: continue
+      distances[node] = distance
+      parents[node] = (parent, edge)
+      if node in targets:
+        total = distance + targets[node][0]
+        if best is None or total < best:
+          best = total
+          bestRoute = node
+      for other, length, otherEdge in self.adjacency[node]:
+        if other not in distances:
+          heapq.heappush(fringe, (distance + length, other, node, otherEdge))
+    route = []
+    node = bestRoute
+    while node is not None:
+      parent, edge = parents[node]
+      route.append((node, edge))
+      node = parent
+    route.reverse()
+    return best, bestRoute, route
+
+  def getDistanceById(self, cell1, cell2):
+    "Returns the maze distance between two cell ids, or None if they are not connected"
+    return self.search(cell1, cell2)[0]
+
+  def getDistance(self, pos1, pos2):
+    return self.getDistanceById(self.getCellId(pos1), self.getCellId(pos2))
+
+  def getPath(self, pos1, pos2):
+    """
+    Returns a shortest list of positions leading from pos1 to pos2, both
+    included, or None if pos2 cannot be reached.
+    """
+    cell1, cell2 = self.getCellId(pos1), self.getCellId(pos2)
+    if cell1 == cell2: return [pos1]
+    distance, lastNode, route = self.search(cell1, cell2)
+    if distance is None: return None
+    cells = [cell1]
+    if lastNode is None:
+      # Straight along the shared corridor
+      edge, offset1 = self.edgeOf[cell1]
+      offset2 = self.edgeOf[cell2][1]
+      corridor = self.edges[edge][3]
+      step = 1 if offset2 > offset1 else -1
+      cells.extend([corridor[offset - 1] for offset in range(offset1 + step, offset2 + step, step)])
+    else:
+      firstNode, firstEdge = route[0]
+      cells.extend(self.walk(cell1, firstEdge, firstNode))
+      for node, edge in route[1:]:
+        cells.extend(self.walk(cells[-1], edge, node))
+      targetEdge = self.edgeOf[cell2][0] if self.nodeIds[cell2] < 0 else None
+      cells.extend(self.walk(cells[-1], targetEdge, None, cell2))
+    cellPositions = self.layout.cells
+    return [cellPositions[cell] for cell in cells]
+
+  def walk(self, cell, edge, node, target = None):
+    """
+    Returns the cells after cell along edge up to and including the junction
+    node (or the corridor cell target), or nothing if already there.
+    """
+    if edge is None: return []
+    first, last, length, corridor = self.edges[edge]
+    nodeCells = self.nodeCells
+    stops = [nodeCells[first]] + list(corridor) + [nodeCells[last]]
+    if target is None: target = nodeCells[node]
+    if cell == target: return []
+    # A loop starts and ends at the same junction; use the end the offsets match
+    starts = [i for i in range(len(stops)) if stops[i] == cell]
+    ends = [i for i in range(len(stops)) if stops[i] == target]
+    start, end = min([(abs(e - s), s, e) for s in starts for e in ends])[1:]
+    step = 1 if end > start else -1
+    return [stops[i] for i in range(start + step, end + step, step)]
+
+# Side of the square clusters used when a layout has no room structure
+CLUSTER_SIZE = 8
+
+clusterGraphMap = {}
+
+def getClusterGraph(layout):
+  """
+  Returns the ClusterGraph of layout, clustered by the rooms mazeGenerator
+  built it from when this process generated it, and by squares otherwise.
+  """
+  if layout.fingerprint not in clusterGraphMap:
+    import mazeGenerator
+    structure = mazeGenerator.getMazeStructure(layout)
+    rooms = None
+    if structure is not None: rooms = structure[0]
+    clusterGraphMap[layout.fingerprint] = ClusterGraph(layout, rooms)
+  return clusterGraphMap[layout.fingerprint]
+
+class ClusterGraph:
+  """
+  Hierarchical (HPA*-style) maze distances.  The cells are split into
+  clusters, either the deepest room of a mazeGenerator room hierarchy that
+  holds them or CLUSTER_SIZE squares.  The cells with a neighbour in another
+  cluster are entrances, and the coarse graph joins entrances of the same
+  cluster by their distance inside it and neighbouring entrances by 1.
+
+  A query searches the start and goal clusters for their entrances, then
+  runs Dijkstra over the coarse graph; getPath then refines each coarse
+  step inside its cluster.  Since every cluster border cell is an entrance,
+  the answers are exact, and the precomputation is only a search from each
+  entrance within its own cluster.
+  """
+  def __init__(self, layout, rooms = None):
+    self.layout = layout
+    numCells = layout.getNumCells()
+    self.clusterOf = [-1] * numCells
+    if rooms is not None:
+      self.clusterByRooms(rooms)
+    self.clusterBySquares()
+    neighborIds = layout.neighborIds
+    clusterOf = self.clusterOf
+    self.entranceOf = {}
+    self.entrances = []
+    for cell in range(numCells):
+      for other in neighborIds[cell]:
+        if clusterOf[other] != clusterOf[cell]:
+          self.entranceOf[cell] = len(self.entrances)
+          self.entrances.append(cell)
+          break
+    self.clusterEntrances = {}
+    for cell in self.entrances:
+      self.clusterEntrances.setdefault(clusterOf[cell], []).append(cell)
+    # Coarse edges: within a cluster by local search, across a border by 1
+    self.adjacency = {}
+    for cell in self.entrances:
+      edges = []
+      distances = self.localSearch(cell)[0]
+      for other in self.clusterEntrances[clusterOf[cell]]:
+        if other != cell and other in distances:
+          edges.append((other, distances[other]))
+      for other in neighborIds[cell]:
+        if clusterOf[other] != clusterOf[cell]:
+          edges.append((other, 1))
+      self.adjacency[cell] = edges
+
+  def clusterByRooms(self, rooms):
+    "Puts each cell in the deepest room that holds it"
+    cellIds = self.layout.cellIds
+    for index, (parent, (xMin, yMin, xMax, yMax)) in enumerate(rooms):
+      # Parents come first, so later rooms are deeper
+      for x in range(xMin, xMax + 1):
+        for y in range(yMin, yMax + 1):
+          cell = cellIds.get((x, y))
+          if cell is not None: self.clusterOf[cell] = index
+
+  def clusterBySquares(self):
+    "Puts the cells without a cluster in CLUSTER_SIZE squares"
+    base = max(self.clusterOf) + 1
+    columns = self.layout.width // CLUSTER_SIZE + 1
+    for cell, (x, y) in enumerate(self.layout.cells):
+      if self.clusterOf[cell] < 0:
+        self.clusterOf[cell] = base + (y // CLUSTER_SIZE) * columns + x // CLUSTER_SIZE
+
+  def getNumClusters(self):
+    return len(set(self.clusterOf))
+
+  def getNumEntrances(self):
+    return len(self.entrances)
+
+  def localSearch(self, source):
+    "Breadth-first search from source that stays in its cluster: (distances, parents)"
+    clusterOf = self.clusterOf
+    cluster = clusterOf[source]
+    neighborIds = self.layout.neighborIds
+    distances = {source: 0}
+    parents = {source: None}
+    frontier = [source]
+    depth = 0
+    while frontier:
+      depth += 1
+      nextFrontier = []
+      for node in frontier:
+        for other in neighborIds[node]:
+          if clusterOf[other] == cluster and other not in distances:
+            distances[other] = depth
+            parents[other] = node
+            nextFrontier.append(other)
+      frontier = nextFrontier
+    return distances, parents
+
+  def search(self, cell1, cell2):
+    """
+    Returns the distance from cell1 to cell2 (None if unreachable) and the
+    coarse path as a list of entrances, or None if staying inside the
+    shared cluster is best.
+    """
+    startDistances = self.localSearch(cell1)[0]
+    best = None
+    if self.clusterOf[cell1] == self.clusterOf[cell2] and cell2 in startDistances:
+      best = startDistances[cell2]
+    goalDistances = self.localSearch(cell2)[0]
+    goals = {}
+    for cell in self.clusterEntrances.get(self.clusterOf[cell2], []):
+      if cell in goalDistances: goals[cell] = goalDistances[cell]
+    fringe = []
+    for cell in self.clusterEntrances.get(self.clusterOf[cell1], []):
+      if cell in startDistances: fringe.append((startDistances[cell], cell, None))
+    heapq.heapify(fringe)
+    distances = {}
+    parents = {}
+    bestEntrance = None
+    while fringe:
+      distance, cell, parent = heapq.heappop(fringe)
+      if best is not None and distance >= best: break
+      if cell in distances: continue
+      distances[cell] = distance
+      parents[cell] = parent
+      if cell in goals and (best is None or distance + goals[cell] < best):
+        best = distance + goals[cell]
+        bestEntrance = cell
+      for other, length in self.adjacency[cell]:
+        if other not in distances:
+          heapq.heappush(fringe, (distance + length, other, cell))
+    if bestEntrance is None: return best, None
+    route = []
+    cell = bestEntrance
+    while cell is not None:
+      route.append(cell)
+      cell = parents[cell]
+    route.reverse()
+    return best, route
+
+  def getDistanceById(self, cell1, cell2):
+    "Returns the maze distance between two cell ids, or None if they are not connected"
+    return self.search(cell1, cell2)[0]
+
+  def getDistance(self, pos1, pos2):
+    return self.getDistanceById(self.getCellId(pos1), self.getCellId(pos2))
+
+  def getCellId(self, pos):
+    cell = self.layout.getCellId(pos)
+    if cell is None: raise Exception("Position not in grid: " + str(pos))
+    return cell
+
+  def getPath(self, pos1, pos2):
+    """
+    Returns a shortest list of positions leading from pos1 to pos2, both
+    included, or None if pos2 cannot be reached.
+    """
+    cell1, cell2 = self.getCellId(pos1), self.getCellId(pos2)
+    distance, route = self.search(cell1, cell2)
+    if distance is None: return None
+    if route is None: route = []
+    cells = [cell1]
+    for cell in route + [cell2]:
+      if cell == cells[-1]: continue
+      if self.clusterOf[cell] != self.clusterOf[cells[-1]]:
+        cells.append(cell)
+      else:
+        cells.extend(self.localPath(cells[-1], cell))
+    cellPositions = self.layout.cells
+    return [cellPositions[cell] for cell in cells]
+
+  def localPath(self, source, target):
+    "Returns the cells after source on a shortest path to target inside their cluster"
+    parents = self.localSearch(source)[1]
+    path = []
+    while target != source:
+      path.append(target)
+      target = parents[target]
+    path.reverse()
+    return path
+
+analyticsMap = {}
+
+def getLayoutAnalytics(layout):
+  "Returns the LayoutAnalytics of layout, computing them the first time its walls are seen"
+  if layout.wallFingerprint not in analyticsMap:
+    analyticsMap[layout.wallFingerprint] = LayoutAnalytics(layout)
+  return analyticsMap[layout.wallFingerprint]
+
+class LayoutAnalytics:
+  """
+  Static facts about a maze, in lists indexed by layout cell id:
+
+    deadEndDepth        moves from a cell to the mouth of the dead end it
+                        is in (0 outside dead ends, which are the parts of
+                        the maze that pruning dead-end cells removes)
+    isArticulation      whether removing the cell disconnects the maze
+    articulationPoints  the cell ids for which isArticulation is true
+    bridges             (cell id, cell id) moves whose removal disconnects
+                        the maze
+
+  getEscapeRoutes(isRed) gives, for each cell, how many routes sharing no
+  cell but their start lead from it to that team's home boundary (for the
+  boundary cells themselves, their number of open neighbours).  They are
+  computed for red, and on a point-symmetric layout mirrored for blue.
+  """
+  def __init__(self, layout):
+    self.layout = layout
+    self.computeDeadEnds()
+    self.computeArticulation()
+    self.escapeRoutes = {True: self.computeEscapeRoutes(layout.redBoundary)}
+    if layout.isSymmetric:
+      self.escapeRoutes[False] = self.escapeRoutes[True][::-1]
+    else:
+      self.escapeRoutes[False] = self.computeEscapeRoutes(layout.blueBoundary)
+
+  def getEscapeRoutes(self, isRed):
+    return self.escapeRoutes[isRed]
+
+  def computeDeadEnds(self):
+    neighborIds = self.layout.neighborIds
+    numCells = self.layout.getNumCells()
+    # Prune cells with one open neighbour left until none remain
+    degree = [len(neighborIds[cell]) for cell in range(numCells)]
+    pruned = [-1] * numCells
+    frontier = [cell for cell in range(numCells) if degree[cell] <= 1]
+    for cell in frontier: pruned[cell] = 0
+    round = 0
+    while frontier:
+      round += 1
+      nextFrontier = []
+      for cell in frontier:
+        for other in neighborIds[cell]:
+          if pruned[other] >= 0: continue
+          degree[other] -= 1
+          if degree[other] <= 1:
+            pruned[other] = round
+            nextFrontier.append(other)
+      frontier = nextFrontier
+    # Depth counts from the unpruned cells; a maze piece that is all dead
+    # end (a tree) counts from the cells pruned last
+    sources = [cell for cell in range(numCells) if pruned[cell] < 0]
+    component = self.getComponents()
+    lastRound = {}
+    for cell in range(numCells):
+      if pruned[cell] >= 0:
+        piece = component[cell]
+        lastRound[piece] = max(lastRound.get(piece, -1), pruned[cell])
+    hasCore = set([component[cell] for cell in sources])
+    for cell in range(numCells):
+      piece = component[cell]
+      if piece not in hasCore and pruned[cell] == lastRound[piece]:
+        sources.append(cell)
+    depth = [-1] * numCells
+    for cell in sources: depth[cell] = 0
+    frontier = sources
+    while frontier:
+      nextFrontier = []
+      for cell in frontier:
+        for other in neighborIds[cell]:
+          if depth[other] < 0:
+            depth[other] = depth[cell] + 1
+            nextFrontier.append(other)
+      frontier = nextFrontier
+    self.deadEndDepth = depth
+
+  def getComponents(self):
+    "Returns a list giving the connected piece of the maze each cell is in"
+    neighborIds = self.layout.neighborIds
+    numCells = self.layout.getNumCells()
+    component = [-1] * numCells
+    for start in range(numCells):
+      if component[start] >= 0: continue
+      component[start] = start
+      stack = [start]
+      while stack:
+        cell = stack.pop()
+        for other in neighborIds[cell]:
+          if component[other] < 0:
+            component[other] = start
+            stack.append(other)
+    return component
+
+  def computeArticulation(self):
+    "Tarjan's depth-first search, without recursion so large mazes are fine"
+    neighborIds = self.layout.neighborIds
+    numCells = self.layout.getNumCells()
+    order = [-1] * numCells
+    low = [0] * numCells
+    isArticulation = [False] * numCells
+    bridges = []
+    counter = 0
+    for root in range(numCells):
+      if order[root] >= 0: continue
+      order[root] = low[root] = counter
+      counter += 1
+      rootChildren = 0
+      stack = [(root, -1, iter(neighborIds[root]))]
+      while stack:
+        cell, parent, children = stack[-1]
+        advanced = False
+        for other in children:
+          if other == parent: continue
+          if order[other] >= 0:
+            low[cell] = min(low[cell], order[other])
+          else:
+            order[other] = low[other] = counter
+            counter += 1
+            if cell == root: rootChildren += 1
+            stack.append((other, cell, iter(neighborIds[other])))
+            advanced = True
+            break
+        if advanced: continue
+        stack.pop()
+        if parent >= 0:
+          low[parent] = min(low[parent], low[cell])
+          if low[cell] > order[parent]:
+            bridges.append((parent, cell))
+          if parent != root and low[cell] >= order[parent]:
+            isArticulation[parent] = True
+      if rootChildren > 1: isArticulation[root] = True
+    self.isArticulation = isArticulation
+    self.articulationPoints = [cell for cell in range(numCells) if isArticulation[cell]]
+    self.bridges = bridges
+
+  def computeEscapeRoutes(self, boundary):
+    cellIds = self.layout.cellIds
+    isTarget = [False] * self.layout.getNumCells()
+    for pos in boundary: isTarget[cellIds[pos]] = True
+    neighborIds = self.layout.neighborIds
+    routes = []
+    for cell in range(len(isTarget)):
+      if isTarget[cell]:
+        routes.append(len(neighborIds[cell]))
+      else:
+        routes.append(countDisjointPaths(neighborIds, cell, isTarget))
+    return routes
+
+def countDisjointPaths(neighborIds, source, isTarget):
+  """
+  Returns how many paths from cell source to target cells share no cell but
+  source, by augmenting paths in the usual split-vertex flow network: each
+  cell is an in-node and an out-node joined by a unit edge, so at most one
+  path passes through it.  States below are (cell, 0) for the in-node and
+  (cell, 1) for the out-node.
+  """
+  limit = len(neighborIds[source])
+  flowArcs = set()   # (u, w): a path steps from cell u to cell w
+  into = {}          # w -> u for each such step
+  through = set()    # cells a path passes through
+  count = 0
+  while count < limit:
+    start = (source, 1)
+    parents = {start: None}
+    frontier = [start]
+    found = None
+    while frontier and found is None:
+      nextFrontier = []
+      for state in frontier:
+        cell, side = state
+        if side == 1:
+          if isTarget[cell]:
+            found = state
+            break
+          moves = [(other, 0) for other in neighborIds[cell] if other != source and (cell, other) not in flowArcs]
+          if cell in through: moves.append((cell, 0))
+        else:
+          moves = []
+          if cell not in through: moves.append((cell, 1))
+          if cell in into: moves.append((into[cell], 1))
+        for move in moves:
+          if move not in parents:
+            parents[move] = state
+            nextFrontier.append(move)
+      frontier = nextFrontier
+    if found is None: break
+    # Walk back along the path, undoing the steps it cancels first
+    steps = []
+    state = found
+    while parents[state] is not None:
+      steps.append((parents[state], state))
+      state = parents[state]
+    added = []
+    for (cell, side), (other, otherSide) in steps:
+      if cell == other:
+        if side == 0: through.add(cell)
+        else: through.discard(cell)
+      elif side == 1:
+        added.append((cell, other))
+      else:
+        # Back along a step other -> cell
+        flowArcs.discard((other, cell))
+        if into.get(cell) == other: del into[cell]
+    for u, w in added:
+      flowArcs.add((u, w))
+      into[w] = u
+    count += 1
+  return count
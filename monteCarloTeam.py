@@ -47,7 +47,7 @@ class monteCarloAttacker(OffensiveReflexAgent):
                 actions.remove(reversed_direction)
             # Randomly chooses a valid action
             a = random.choice(actions)
-            copy = copy.generateSuccessor(self.index, a)
+            copy = copy.generateSuccessor(self.index, a, self.successorCache)
             value += decay ** decay_index * self.evaluate(copy, Directions.STOP)
             depth -= 1
             decay_index += 1
@@ -64,7 +64,7 @@ class monteCarloAttacker(OffensiveReflexAgent):
         possibleValue = []
 
         for a in actions:
-            next_state = gameState.generateSuccessor(self.index, a)
+            next_state = gameState.generateSuccessor(self.index, a, self.successorCache)
             score = 0
             for i in range(0, 10):
                 score += self.randomSimulation(1, next_state, 0.8) / 10
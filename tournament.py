@@ -0,0 +1,266 @@
+# tournament.py
+# -------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Runs a round-robin capture tournament:
+
+  > python tournament.py -t baselineTeam,myTeam,reflex -l defaultCapture,RANDOM23 --workers 8
+
+Every pair of teams plays on every layout once with each colour assignment.
+The matches are played in a pool of worker processes, and each finished
+match is appended to a checkpoint file, so running the same command again
+after an interruption only plays the matches that are still missing.  The
+standings are printed from the checkpoint when every match is done.
+"""
+
+import os, sys, random, json
+import capture
+
+# Points for a win and a tie in the standings
+WIN_POINTS = 3
+TIE_POINTS = 1
+
+def expandMatches(teams, layouts, numGames=1):
+  """
+  Returns the matches of a round robin as (red, blue, layout, game) tuples:
+  every pair of teams on every layout, with both colour assignments, numGames
+  times.
+  """
+  matches = []
+  for game in range(numGames):
+    for layoutName in layouts:
+      for i in range(len(teams)):
+        for j in range(i + 1, len(teams)):
+          matches.append((teams[i], teams[j], layoutName, game))
+          matches.append((teams[j], teams[i], layoutName, game))
+  return matches
+
+def resolveLayoutNames(layouts, seed):
+  """
+  Replaces every bare RANDOM in layouts by RANDOM<seed>, with seeds drawn
+  from the tournament seed, so that both colours of a pairing play the same
+  maze and a resumed tournament plays the mazes it started with.
+  """
+  rand = random.Random(seed)
+  return [name == 'RANDOM' and 'RANDOM%d' % rand.randint(0, 99999999) or name for name in layouts]
+
+def matchKey(match):
+  "The identifier of a match in the checkpoint"
+  return '%s|%s|%s|%d' % match
+
+def loadCheckpoint(path):
+  """
+  Returns the results recorded in the checkpoint at path, by match key.  A
+  line cut short by an interruption is ignored, so its match is played again.
+  """
+  results = {}
+  if not os.path.exists(path): return results
+  with open(path) as f:
+    for line in f:
+      try:
+        result = json.loads(line)
+      except ValueError:
+        continue
+      results[result['key']] = result
+  return results
+
+def openCheckpoint(path):
+  "Opens the checkpoint for appending, ending a line cut short by an interruption first"
+  f = open(path, 'a+')
+  f.seek(0, os.SEEK_END)
+  if f.tell() > 0:
+    f.seek(-1, os.SEEK_END)
+    if f.read(1) != '\n':
+      f.write('\n')
+  return f
+
+def appendCheckpoint(f, result):
+  "Writes one finished match to the checkpoint and flushes it to disk"
+  f.write(json.dumps(result, sort_keys=True) + '\n')
+  f.flush()
+  os.fsync(f.fileno())
+
+# The layouts and loaded teams of a tournament worker process
+workerState = None
+
+def initTournamentWorker(layouts, length, seed, sandbox, parallelStartup):
+  "Keeps a worker's layouts by name; the teams are loaded as matches need them"
+  global workerState
+  workerState = {'layouts': layouts, 'length': length, 'seed': seed, 'sandbox': sandbox,
+                 'parallelStartup': parallelStartup, 'teams': {}}
+
+def getWorkerTeam(factory):
+  "Loads a team module the first time this worker needs it"
+  teams = workerState['teams']
+  if factory not in teams:
+    if workerState['sandbox'] is not None:
+      # Each team gets a process of its own, which lives as long as the worker
+      import agentSandbox
+      teams[factory] = agentSandbox.SandboxedTeam(factory, workerState['sandbox'], True).createTeam
+    else:
+      # A worker loads several teams for either side, and teams in different
+      # directories can share a file name, so each gets a module of its own
+      moduleName = 'tournament%d_%s' % (len(teams), os.path.basename(factory).replace('.', '_'))
+      teams[factory] = capture.loadTeam(True, factory, moduleName)
+  return teams[factory]
+
+def playMatch(match):
+  """
+  Plays one match in a worker process, with fresh agents, muted agent output
+  and enforced time limits, and returns its result.
+  """
+  import textDisplay
+  red, blue, layoutName, game = match
+  result = {'key': matchKey(match), 'red': red, 'blue': blue, 'layout': layoutName, 'game': game}
+  random.seed(repr((workerState['seed'], match)))
+  createRed, createBlue = getWorkerTeam(red), getWorkerTeam(blue)
+  if createRed is None or createBlue is None:
+    # A team that cannot be loaded loses the match, as if it had crashed
+    result.update({'score': createRed is None and -1 or 1, 'crashed': True, 'timeout': False, 'actions': None})
+    return result
+  redAgents = capture.createAgents(True, createRed, {})
+  blueAgents = capture.createAgents(False, createBlue, {})
+  agents = sum([list(el) for el in zip(redAgents, blueAgents)], [])
+  rules = capture.CaptureRules(quiet=True, parallelStartup=workerState['parallelStartup'])
+  g = rules.newGame(workerState['layouts'][layoutName], agents, textDisplay.NullGraphics(),
+                    workerState['length'], True, True)
+  g.run()
+  result.update({'score': g.state.data.score, 'crashed': g.agentCrashed, 'timeout': g.agentTimeout,
+                 'actions': g.moveHistory})
+  return result
+
+def runTournament(teams, layouts, checkpoint, workers=1, numGames=1, length=1200, seed='tournament', replayDir=None, sandbox=None,
+                  parallelStartup=False):
+  """
+  Plays the matches of the round robin that are not yet in the checkpoint and
+  returns every result, finished earlier or now, by match key.  With sandbox,
+  a memory limit in bytes (0 for none), every team runs in its own process
+  (see agentSandbox.py); with parallelStartup the agents of a match are set
+  up concurrently (see game.Game).
+  """
+  layouts = resolveLayoutNames(layouts, seed)
+  matches = expandMatches(teams, layouts, numGames)
+  results = loadCheckpoint(checkpoint)
+  remaining = [match for match in matches if matchKey(match) not in results]
+  print 'Tournament: %d matches, %d already played' % (len(matches), len(matches) - len(remaining))
+  if remaining:
+    playMatches(remaining, layouts, results, checkpoint, workers, length, seed, replayDir, sandbox, parallelStartup)
+  return dict([(matchKey(match), results[matchKey(match)]) for match in matches])
+
+def playMatches(matches, layouts, results, checkpoint, workers, length, seed, replayDir, sandbox, parallelStartup):
+  "Plays matches in a pool of workers, adding each result to results and the checkpoint"
+  import multiprocessing, distanceCalculator
+  layoutsByName = dict([(name, capture.loadCaptureLayout(name)) for name in layouts])
+  for l in layoutsByName.values():
+    distanceCalculator.publishDistances(l)
+  if replayDir is not None and not os.path.isdir(replayDir):
+    os.makedirs(replayDir)
+  pool = multiprocessing.Pool(workers, initTournamentWorker, (layoutsByName, length, seed, sandbox, parallelStartup))
+  try:
+    with openCheckpoint(checkpoint) as f:
+      for done, result in enumerate(pool.imap_unordered(playMatch, matches)):
+        actions = result.pop('actions')
+        if replayDir is not None and actions is not None:
+          saveReplay(replayDir, result, layoutsByName[result['layout']], actions, length)
+        appendCheckpoint(f, result)
+        results[result['key']] = result
+        print '[%d/%d] %s (red) vs %s (blue) on %s: %d' % (done + 1, len(matches), result['red'],
+                                                        result['blue'], result['layout'], result['score'])
+  finally:
+    pool.terminate()
+    pool.join()
+    for l in layoutsByName.values():
+      distanceCalculator.unpublishDistances(l)
+  return results
+
+def saveReplay(replayDir, result, layout, actions, length):
+  "Writes a match in the format of capture.py --replay"
+  import cPickle, game
+  components = {'layout': layout, 'agents': [game.Agent() for i in range(4)], 'actions': actions, 'length': length,
+                'redTeamName': result['red'], 'blueTeamName': result['blue']}
+  fname = 'replay-%s-vs-%s-%s-%d' % (result['red'], result['blue'], result['layout'], result['game'])
+  with open(os.path.join(replayDir, fname.replace(os.sep, '_')), 'wb') as f:
+    cPickle.dump(components, f)
+
+def getStandings(teams, results):
+  """
+  Returns the standings as [(points, wins, ties, losses, score, team)], best
+  first.  Score is the team's total margin over its matches.
+  """
+  table = dict([(team, [0, 0, 0, 0, 0]) for team in teams])
+  for result in results.values():
+    if result['red'] not in table or result['blue'] not in table: continue
+    for team, sign in (result['red'], 1), (result['blue'], -1):
+      score = sign * result['score']
+      row = table[team]
+      if score > 0:
+        row[0] += WIN_POINTS
+        row[1] += 1
+      elif score == 0:
+        row[0] += TIE_POINTS
+        row[2] += 1
+      else:
+        row[3] += 1
+      row[4] += score
+  standings = [tuple(row) + (team,) for team, row in table.items()]
+  standings.sort(key=lambda row: (-row[0], -row[4], row[5]))
+  return standings
+
+def printStandings(standings):
+  print '%-24s %6s %4s %4s %4s %6s' % ('Team', 'Points', 'Won', 'Tied', 'Lost', 'Score')
+  for points, wins, ties, losses, score, team in standings:
+    print '%-24s %6d %4d %4d %4d %6d' % (team, points, wins, ties, losses, score)
+
+def readCommand(argv):
+  from optparse import OptionParser
+  parser = OptionParser(__doc__)
+  parser.add_option('-t', '--teams', help='Comma-separated team modules')
+  parser.add_option('-l', '--layouts', default='defaultCapture',
+                    help=capture.default('Comma-separated layouts; RANDOM<seed> for a random maze'))
+  parser.add_option('-n', '--numGames', type='int', default=1,
+                    help=capture.default('Games per pairing, colour assignment and layout'))
+  parser.add_option('-i', '--time', type='int', default=1200,
+                    help=capture.default('TIME limit of a game in moves'))
+  parser.add_option('--workers', type='int', default=1,
+                    help=capture.default('Number of processes that play matches in parallel'))
+  parser.add_option('--checkpoint', default='tournament.results',
+                    help=capture.default('File of finished matches, read to resume a tournament'))
+  parser.add_option('--seed', default='tournament',
+                    help=capture.default('Seed of the random mazes and games'))
+  parser.add_option('--replays', default=None,
+                    help='Directory to write the replay of every match to')
+  parser.add_option('--sandbox', action='store_true', default=False,
+                    help='Run every team in its own process (see agentSandbox.py)')
+  parser.add_option('--agent-memory', type='int', dest='agentMemory', default=0,
+                    help=capture.default('Address space limit of a sandboxed team in megabytes (0 for none)'))
+  parser.add_option('--parallel-startup', action='store_true', dest='parallelStartup', default=False,
+                    help='With --sandbox, set up all agents of a match at once, each within its own startup time '
+                         '(agents drawing random numbers on startup then do so in no fixed order)')
+  options, otherjunk = parser.parse_args(argv)
+  assert len(otherjunk) == 0, "Unrecognized options: " + str(otherjunk)
+  if not options.teams: parser.error('No teams given')
+  teams = options.teams.split(',')
+  if len(teams) < 2: parser.error('A tournament needs at least two teams')
+  if options.parallelStartup and not options.sandbox: parser.error('--parallel-startup needs --sandbox')
+  sandbox = None
+  if options.sandbox: sandbox = options.agentMemory << 20
+  return {'teams': teams, 'layouts': options.layouts.split(','), 'checkpoint': options.checkpoint,
+          'workers': options.workers, 'numGames': options.numGames, 'length': options.time,
+          'seed': options.seed, 'replayDir': options.replays,
+          'sandbox': sandbox, 'parallelStartup': options.parallelStartup}
+
+if __name__ == '__main__':
+  options = readCommand(sys.argv[1:])
+  results = runTournament(**options)
+  printStandings(getStandings(options['teams'], results))
@@ -588,47 +588,256 @@ def pause():
 
 # code to handle timeouts
 #
-# FIXME
-# NOTE: TimeoutFuncton is NOT reentrant.  Later timeouts will silently
-# disable earlier timeouts.  Could be solved by maintaining a global list
-# of active time outs.  Currently, questions which have test cases calling
-# this have all student code so wrapped.
+# A Deadline bounds the code run inside it, to the millisecond, in any thread.
+# On the main thread an interval timer (SIGALRM) interrupts the code; on other
+# threads, or where there is no setitimer, a shared watchdog thread raises the
+# timeout in the running thread through PyThreadState_SetAsyncExc.  Deadlines
+# nest: each thread keeps a stack of them, the earliest expiry is the one that
+# is armed, and the outermost expired deadline is the one reported.  Python
+# only acts on a signal or an asynchronous exception between bytecodes, so
+# code blocked in a long C call is stopped when the call returns, and a block
+# that ends past its expiry without being interrupted still times out.
 #
 import signal
 import time
+import threading, thread, os
+try:
+    import ctypes
+    _setAsyncExc = ctypes.pythonapi.PyThreadState_SetAsyncExc
+except (ImportError, AttributeError):
+    _setAsyncExc = None
+
+# Seconds to wait before trying again when a deadline expires inside the deadline code
+DEADLINE_RETRY = 0.0001
+
 class TimeoutFunctionException(Exception):
     """Exception to raise on a timeout"""
     pass
 
+class DeadlineExceeded(TimeoutFunctionException):
+    """
+    The TimeoutFunctionException raised by an expired Deadline, which is its
+    deadline attribute.
+    """
+    def __init__(self, deadline=None):
+        TimeoutFunctionException.__init__(self)
+        self.deadline = deadline
+
+class Deadline:
+    """
+    Limits the code run in a with block to seconds (a float):
+
+      with Deadline(0.5) as deadline:
+          action = agent.getAction(state)
+
+    raises DeadlineExceeded if the block takes longer.  Deadlines can be
+    nested, for example a per-move budget inside a total one, and deadline.
+    elapsed is the exact time the block took once it has ended.
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start = None
+        self.expiry = None
+        self.elapsed = None
+        self.done = False
+        self.interrupted = False
+        self.threadId = None
+        self.asynchronous = False
+
+    def remaining(self):
+        "Returns the seconds left before the deadline, which are negative once it has passed"
+        if self.start is None: return self.seconds
+        return self.expiry - time.time()
+
+    def __enter__(self):
+        self.threadId = thread.get_ident()
+        stack = _getDeadlines()
+        # Deadlines that have ended or fired no longer need the stack
+        stack[:] = [deadline for deadline in stack if not deadline.done and not deadline.interrupted]
+        self.start = time.time()
+        self.expiry = self.start + self.seconds
+        if self.seconds <= 0:
+            self.done = True
+            self.elapsed = 0.0
+            raise DeadlineExceeded(self)
+        self.asynchronous = not _canUseTimer()
+        try:
+            if not self.asynchronous and signal.getsignal(signal.SIGALRM) != _handleAlarm:
+                _timerState['handler'] = signal.signal(signal.SIGALRM, _handleAlarm)
+            stack.append(self)
+            if self.asynchronous:
+                _watchdog.watch(self)
+            else:
+                _armTimer(stack)
+        except:
+            # An outer deadline fired before the block started, so __exit__ will not run
+            self.__exit__(*sys.exc_info())
+            raise
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        raised = None
+        while True:
+            # An outer deadline can still fire while this one stops
+            try:
+                self._stop()
+                break
+            except DeadlineExceeded, e:
+                raised = e
+        if excType is None:
+            if raised is None and (self.interrupted or self.elapsed > self.seconds):
+                raised = DeadlineExceeded(self)
+            if raised is not None:
+                raise raised
+        elif isinstance(excValue, DeadlineExceeded) and excValue.deadline is None and self.interrupted:
+            # Exceptions raised from the watchdog are created without their deadline
+            excValue.deadline = self
+        return False
+
+    def _stop(self):
+        stack = _getDeadlines()
+        if self.asynchronous:
+            # A with statement takes the lock and sets up its release in one
+            # bytecode, so an asynchronous exception cannot leave it held
+            with _watchdog.lock:
+                if not self.done:
+                    self.done = True
+                    if self.interrupted: _setAsyncExc(ctypes.c_long(self.threadId), None)
+        else:
+            self.done = True
+        if self.elapsed is None:
+            self.elapsed = time.time() - self.start
+        if self in stack:
+            # Inner deadlines whose exit was cut short by a timeout end here too
+            index = stack.index(self)
+            for deadline in stack[index + 1:]:
+                deadline.done = True
+            del stack[index:]
+        if not self.asynchronous:
+            _armTimer(stack)
+            if not stack and 'handler' in _timerState:
+                # None stands for a handler not installed from Python, which
+                # cannot be put back; SIG_DFL and SIG_IGN (plain ints) can
+                handler = _timerState.pop('handler')
+                if handler is not None: signal.signal(signal.SIGALRM, handler)
+
+_threadDeadlines = threading.local()
+_timerState = {}
+
+def _getDeadlines():
+    "Returns the stack of the current thread's active deadlines"
+    try:
+        return _threadDeadlines.stack
+    except AttributeError:
+        _threadDeadlines.stack = []
+        return _threadDeadlines.stack
+
+def _canUseTimer():
+    return hasattr(signal, 'setitimer') and isinstance(threading.current_thread(), threading._MainThread)
+
+def _armTimer(stack):
+    "Sets the interval timer to the earliest expiry of the main thread's deadlines"
+    active = [deadline.expiry for deadline in stack if not deadline.done and not deadline.interrupted]
+    if active:
+        signal.setitimer(signal.ITIMER_REAL, max(min(active) - time.time(), 1e-6))
+    else:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _getExpired(stack):
+    "Returns the outermost active deadline that has expired and not yet fired, if any"
+    now = time.time()
+    for deadline in stack:
+        if not deadline.done and not deadline.interrupted and deadline.expiry <= now:
+            return deadline
+    return None
+
+def _inDeadlineCode(frame):
+    "Returns whether frame is running the deadline code, which a timeout must not cut short"
+    return frame is not None and frame.f_code in _DEADLINE_CODE
+
+def _handleAlarm(signum, frame):
+    stack = _getDeadlines()
+    deadline = _getExpired(stack)
+    if deadline is None:
+        # Early or stale alarm: wait for the next expiry instead
+        _armTimer(stack)
+        return
+    if _inDeadlineCode(frame):
+        signal.setitimer(signal.ITIMER_REAL, DEADLINE_RETRY)
+        return
+    deadline.interrupted = True
+    raise DeadlineExceeded(deadline)
+
+class _Watchdog:
+    """
+    A daemon thread that raises DeadlineExceeded in the threads of expired
+    deadlines that cannot use the interval timer.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.heap = []
+        self.thread = None
+        self.pid = os.getpid()
+
+    def watch(self, deadline):
+        if self.pid != os.getpid():
+            # A forked child inherits the watchdog but not its thread
+            self.__init__()
+        with self.lock:
+            heapq.heappush(self.heap, (deadline.expiry, id(deadline), deadline))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='DeadlineWatchdog')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self):
+        with self.lock:
+            while True:
+                while self.heap and self.heap[0][2].done:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                wait = self.heap[0][0] - time.time()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                expiry, key, deadline = heapq.heappop(self.heap)
+                if _inDeadlineCode(sys._current_frames().get(deadline.threadId)):
+                    heapq.heappush(self.heap, (expiry + DEADLINE_RETRY, key, deadline))
+                    continue
+                deadline.interrupted = True
+                if _setAsyncExc is not None:
+                    _setAsyncExc(ctypes.c_long(deadline.threadId), ctypes.py_object(DeadlineExceeded))
+
+_watchdog = _Watchdog()
+
+_DEADLINE_CODE = set([f.func_code for f in Deadline.__enter__.im_func, Deadline.__exit__.im_func,
+                      Deadline._stop.im_func, _getDeadlines, _armTimer, _Watchdog.watch.im_func])
 
 class TimeoutFunction:
+    """
+    Wraps function so that calling it raises TimeoutFunctionException after
+    timeout seconds, which may be fractional.  Calls can be nested and made
+    from any thread (see Deadline); elapsed is the time the last call took.
+    """
     def __init__(self, function, timeout):
         self.timeout = timeout
         self.function = function
+        self.elapsed = None
 
     def handle_timeout(self, signum, frame):
         raise TimeoutFunctionException()
 
     def __call__(self, *args, **keyArgs):
-        # If we have SIGALRM signal, use it to cause an exception if and
-        # when this function runs too long.  Otherwise check the time taken
-        # after the method has returned, and throw an exception then.
-        if hasattr(signal, 'SIGALRM'):
-            old = signal.signal(signal.SIGALRM, self.handle_timeout)
-            signal.alarm(self.timeout)
-            try:
-                result = self.function(*args, **keyArgs)
-            finally:
-                signal.signal(signal.SIGALRM, old)
-            signal.alarm(0)
-        else:
-            startTime = time.time()
-            result = self.function(*args, **keyArgs)
-            timeElapsed = time.time() - startTime
-            if timeElapsed >= self.timeout:
-                self.handle_timeout(None, None)
-        return result
-
+        deadline = Deadline(self.timeout)
+        try:
+            with deadline:
+                return self.function(*args, **keyArgs)
+        finally:
+            self.elapsed = deadline.elapsed
 
 
 _ORIGINAL_STDOUT = None
@@ -639,6 +848,26 @@ class WritableNull:
     def write(self, string):
         pass
 
+class ThreadOutput:
+    """
+    Stands in for sys.stdout or sys.stderr while several threads run: the
+    writes of a thread go to its stream in streams, a dict by thread id,
+    and those of any other thread to stream.
+    """
+    def __init__(self, stream, streams):
+        self.stream = stream
+        self.streams = streams
+
+    def write(self, string):
+        self.streams.get(thread.get_ident(), self.stream).write(string)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.streams.get(thread.get_ident(), self.stream).flush()
+
 def mutePrint():
     global _ORIGINAL_STDOUT, _ORIGINAL_STDERR, _MUTED
     if _MUTED: